@@ -67,18 +67,18 @@ def getHandsFromState(state):
 	return dealerHand, playerHand
 
 
-def dealPlayer():
+def dealPlayer(shoe=None):
 	hand = (0, False)
-	card1 = drawCard()
+	card1 = drawCard(shoe)
 	hand = addCardToHand(card1, hand)
-	card2 = drawCard()
+	card2 = drawCard(shoe)
 	hand = addCardToHand(card2, hand)
 	return hand
 
 
-def dealDealer():
+def dealDealer(shoe=None):
 	hand = (0, False)
-	card1 = drawCard()
+	card1 = drawCard(shoe)
 	hand = addCardToHand(card1, hand)
 	return (card1, hand)
 
@@ -90,8 +90,10 @@ def addCardToHand(card, hand):
 		hasAce = True
 	return (total, hasAce)
 
-# To do, drawCard method is limited
-def drawCard():
+# Draws from the infinite deck, or from shoe (see shoe.py) when one is given
+def drawCard(shoe=None):
+	if shoe is not None:
+		return shoe.draw()
 	card = random.randint(1, 13)
 	if card > 10:
 		card = 10
@@ -136,11 +138,21 @@ def getRewardByHands(dealer_hand, player_hand):
 	elif (player_val > dealer_val):
 		return 1.0
 
-def dealerPlay(hand):
+def dealerPlay(hand, shoe=None):
 	while getHandTotal(hand) < 17:
-		hand = addCardToHand(drawCard(), hand)
+		hand = addCardToHand(drawCard(shoe), hand)
 	return hand
 
+def getDealerPlay(dealerTable=None, shoe=None):
+	# with a table from dealertable.buildDealerTable the final hand is sampled instead of simulated,
+	# the table assumes the infinite deck so it is only used without a shoe
+	if dealerTable is None or shoe is not None:
+		if shoe is None:
+			return dealerPlay
+		return lambda hand: dealerPlay(hand, shoe)
+	from dealertable import sampleDealerHand
+	return lambda hand: sampleDealerHand(dealerTable, hand)
+
 def getNextState(dealerCard, playerHand):
 	return (dealerCard, getHandTotal(playerHand), handHasUseableAce(playerHand))
 
@@ -154,64 +166,91 @@ def getBestActionByQ(qMap, state):
 		return False
 
 # Q learning.
-def q_learning(learningTimes, alpha, discount, epsilon):
+# With an instrumentation of profiling.py, the time of every phase of the episodes is recorded in it
+def q_learning(learningTimes, alpha, discount, epsilon, dealerTable=None, shoe=None, instrumentation=None):
 	# initialize
 	qMap = initializeQMap()
 	counterMap = initializeCounterMap()
 	allStates = getAllPossibleStates()
+	playDealer = getDealerPlay(dealerTable, shoe)
+	draw = drawCard
+	actionWithEpsilon = getActionWithEpsilon
+	timed = instrumentation is not None
+	if timed:
+		instrumentation.begin('q_learning')
+		draw = instrumentation.wrap('drawCard', draw)
+		actionWithEpsilon = instrumentation.wrap('getActionWithEpsilon', actionWithEpsilon)
+		playDealer = instrumentation.wrap('dealerPlay', playDealer)
+		clock = instrumentation.clock
+		updateKey = instrumentation.key('update')
 	for n in range(0, learningTimes):
-		# select a start state randomly 
-		state = getRandomState(allStates)
-		dealerHand, playerHand = getHandsFromState(state)
-		dealerCard = state[0]
+		if shoe is not None:
+			# deal the first cards from the shoe too, so its composition matches the hands that are learned
+			shoe.startRound()
+			playerHand = dealPlayer(shoe)
+			dealerCard, dealerHand = dealDealer(shoe)
+			state = getNextState(dealerCard, playerHand)
+		else:
+			# select a start state randomly 
+			state = getRandomState(allStates)
+			dealerHand, playerHand = getHandsFromState(state)
+			dealerCard = state[0]
 		while True:
-			action = getActionWithEpsilon(qMap, state, epsilon)
+			action = actionWithEpsilon(qMap, state, epsilon)
 			stateActionPair = (state, action)
-			counterMap[stateActionPair] = counterMap[stateActionPair] + 1.0
+			playing = False
 			# Player hits
 			if action:
-				playerHand = addCardToHand(drawCard(), playerHand)
+				playerHand = addCardToHand(draw(shoe), playerHand)
 				# Player does not bust
 				if getHandTotal(playerHand) <= 21:
-					# Update qMap
 					nextState = getNextState(dealerCard, playerHand)
-					maxQ = getMaxQByState(qMap, nextState)
-					diff = (discount * maxQ) - qMap[stateActionPair]
-					qMap[stateActionPair] = qMap[stateActionPair] + (alpha / counterMap[stateActionPair] * diff)
-					state = nextState
+					target = discount * getMaxQByState(qMap, nextState)
+					playing = True
 				# Player busts
 				else:
-					# Update qMap
-					diff = (-1) - qMap[stateActionPair]
-					qMap[stateActionPair] = qMap[stateActionPair] + (alpha / counterMap[stateActionPair] * diff)
-					break;
+					target = -1
 			# Player stands
 			else:
 				# Dealer play
-				dealerHand = dealerPlay(dealerHand)
-				# Update qMap
-				diff = getRewardByHands(dealerHand, playerHand) - qMap[stateActionPair]
-				qMap[stateActionPair] = qMap[stateActionPair] + (alpha / counterMap[stateActionPair] * diff)
+				dealerHand = playDealer(dealerHand)
+				target = getRewardByHands(dealerHand, playerHand)
+
+			# Update qMap
+			if timed:
+				start = clock()
+			counterMap[stateActionPair] = counterMap[stateActionPair] + 1.0
+			diff = target - qMap[stateActionPair]
+			qMap[stateActionPair] = qMap[stateActionPair] + (alpha / counterMap[stateActionPair] * diff)
+			if timed:
+				instrumentation.record(updateKey, clock() - start)
+			if not playing:
 				break;
+			state = nextState
 
 		#epsilon = epsilon * ((learningTimes - n) / learningTimes)
+	if timed:
+		instrumentation.end()
 	return qMap
 
 # Q learning.
-def q_learning_test_print_average(Q, n_times):
+def q_learning_test_print_average(Q, n_times, dealerTable=None, shoe=None):
 	# initialize
 	qMap = Q
 	gain = 0.0
+	playDealer = getDealerPlay(dealerTable, shoe)
 	for n in range(0, n_times):
-		playerHand = dealPlayer()
-		dealerCard, dealerHand = dealDealer()
+		if shoe is not None:
+			shoe.startRound()
+		playerHand = dealPlayer(shoe)
+		dealerCard, dealerHand = dealDealer(shoe)
 		state = getNextState(dealerCard, playerHand)
 		while True:
 			action = getBestActionByQ(qMap, state)
 			stateActionPair = (state, action)
 			# Player hits
 			if action:
-				playerHand = addCardToHand(drawCard(), playerHand)
+				playerHand = addCardToHand(drawCard(shoe), playerHand)
 				# Player does not bust
 				if getHandTotal(playerHand) <= 21:
 					nextState = getNextState(dealerCard, playerHand)
@@ -223,7 +262,7 @@ def q_learning_test_print_average(Q, n_times):
 			# Player stands
 			else:
 				# Dealer play
-				dealerHand = dealerPlay(dealerHand)
+				dealerHand = playDealer(dealerHand)
 				gain = gain + getRewardByHands(dealerHand, playerHand)
 				break;
 
@@ -284,15 +323,54 @@ def policyHelper(Q):
     policySet.append(policy1)
     return policySet
 
-def getPolicySet():
+def getPolicySet(engine='vectorized', useCache=True, decks=None, progress=None, instrumentation=None):
+    # progress is called with (episodes, maxEpisodes, churn, maxDelta) during vectorized training
+    # instrumentation (see profiling.py) records where the training time goes, nothing is recorded on a cache hit
     # set parameters
     n_iter_q = 3500000
     alpha = 1
     epsilon = 0.1
     discount = 1
-    # run learning algorithms
-    print('Q-LEARNING -- UNBIASED DECK')
-    Q = q_learning(n_iter_q, alpha, discount, epsilon)
+    if decks is not None:
+        # only the python loop can deal from a finite shoe
+        engine = 'python'
+    params = {'n_iter': n_iter_q, 'alpha': alpha, 'epsilon': epsilon, 'discount': discount,
+              'deck': 'infinite' if decks is None else '%d decks' % decks, 'engine': engine,
+              'stop': 'converged' if engine == 'vectorized' else 'fixed'}
+
+    def train():
+        # run learning algorithms
+        if decks is not None:
+            from shoe import Shoe
+            print('Q-LEARNING -- %d DECK SHOE' % decks)
+            return q_learning(n_iter_q, alpha, discount, epsilon, shoe=Shoe(decks), instrumentation=instrumentation)
+        print('Q-LEARNING -- UNBIASED DECK')
+        if engine == 'vectorized':
+            # the batched numpy engine learns the same Q values an order of magnitude faster,
+            # and stops as soon as the policy stopped changing, n_iter_q is only a ceiling
+            from vectorq import q_learning_until_converged, qArrayToMap
+            Q, n_iter, reason = q_learning_until_converged(n_iter_q, alpha, discount, epsilon, progress=progress,
+                                                           instrumentation=instrumentation)
+            print('stopped after %d iterations (%s)' % (n_iter, reason))
+            return qArrayToMap(Q)
+        elif engine == 'parallel':
+            # the same engine with the episodes shared between one process per core
+            import os
+            from vectorq import q_learning_parallel, qArrayToMap
+            return qArrayToMap(q_learning_parallel(n_iter_q, os.cpu_count() or 1, alpha, discount, epsilon))
+        elif engine == 'exact':
+            # no sampling at all, the exact Q values from the dealer distributions and value iteration
+            from solver import solveQMap
+            return solveQMap(discount)
+        else:
+            return q_learning(n_iter_q, alpha, discount, epsilon, instrumentation=instrumentation)
+
+    if useCache:
+        # load the Q values of a previous launch if the parameters and rules did not change
+        from policycache import cachedQMap
+        Q = cachedQMap(params, train)
+    else:
+        Q = train()
     # print_Q(Q)
     # print_V(Q)
     print_policy(Q)
@@ -304,11 +382,14 @@ def test():
     alpha = 1
     epsilon = 0.2
     discount = 1
-    n_iter = 100000
+    n_iter = 1000000
+    # the batched evaluator plays the same hands as q_learning_test_print_average, much faster
+    from evaluate import evaluatePolicy
     while (n_iter_q <= 5120000):
     	Q = q_learning(n_iter_q, alpha, discount, epsilon)
     	print('q_learning times %d' % n_iter_q, end = ' ')
-    	q_learning_test_print_average(Q, n_iter)
+    	result = evaluatePolicy(policyHelper(Q), n_iter)
+    	print('AverageGain: %6.3f +/- %.3f' % (result.meanGain, result.standardError))
     	n_iter_q = n_iter_q * 2
 
 if __name__ == '__main__':
@@ -0,0 +1,381 @@
+import argparse
+import collections
+import multiprocessing
+import os
+import time
+import numpy as np
+from evaluate import policyArray
+from shoe import HI_LO
+from utils import shuffleShoes
+from vectorq import PLAYER_TOTALS, handTotals, getRewardsByTotals, splitEvenly
+
+"""
+Bankroll simulation of a play policy and a bet sizing rule.
+
+A trajectory is a whole session of the game: it starts with FUNDS and plays
+hands until it is ruined (no funds left) or reaches GOAL, the two thresholds
+at which Game.endRound ends the game, or until it played maxHands. Every
+trajectory deals from its own shoe (one row of utils.shuffleShoes) so the
+count based rules see the same true counts as a player at the table would.
+The hands follow the policySet of ai.policyHelper (hit or stand).
+
+The payouts are the usual casino rules, which are not exactly engine.Game's:
+a player natural pays 3:2, a dealer natural wins at once, and two naturals
+push. engine.Game loses the bet when both have a natural, and it pays 3:2 on
+any win whose second card is an ace, or whose first card is an ace in a two
+card hand. So the simulated bankrolls are those of a standard table, not an
+exact replay of the game.
+
+The trajectories of a batch play together, one hand per step, with numpy.
+Batches are shared between worker processes like vectorq.q_learning_parallel:
+
+    python bankroll.py --rule flat --bet 10
+    python bankroll.py --rule ramp --unit 5 --trajectories 4000000
+    python bankroll.py --rule kelly --fraction 0.5
+
+A bet rule has a bets(bankroll, trueCount) method that takes arrays and
+returns the bet of every trajectory. The bets are then made multiples of
+BET_STEP, at least MIN_BET and at most the bankroll, like the bet buttons do.
+"""
+
+FUNDS = 100.0
+GOAL = 200.0
+MIN_BET = 5.0
+BET_STEP = 5.0
+MAX_HANDS = 10000
+
+BATCH_SIZE = 65536
+PERCENTILES = (5, 25, 50, 75, 95)
+
+HI_LO_VALUES = np.array(HI_LO)
+
+# Gain per unit bet of a hand, as a line of the true count before the deal
+Edge = collections.namedtuple('Edge', ['meanGain', 'intercept', 'edgePerCount', 'variance'])
+
+BankrollResult = collections.namedtuple('BankrollResult', [
+    'trajectories',
+    'riskOfRuin',           # share of the trajectories that lost every dollar
+    'riskOfRuinError',      # standard error of riskOfRuin
+    'goalRate',             # share that reached the goal
+    'unfinishedRate',       # share still playing after maxHands
+    'meanHandsToGoal',      # None if no trajectory reached the goal
+    'meanHandsToRuin',
+    'handsPercentiles',     # dict of percentile to hands played, over the finished trajectories
+    'bankrollPercentiles',  # dict of percentile to final bankroll, over every trajectory
+])
+
+class Shoes():
+    """ One shuffled shoe per row, each dealt through its own cursor like utils.Deck, with the Hi-Lo running
+    count of the cards dealt since its last shuffle. A row is reshuffled at the start of a round once it reached
+    the cut card, or in the middle of a round if it ran out. """
+
+    def __init__(self, rows, decks=1, penetration=0.75, rng=None):
+        self.decks = decks
+        self.size = 52 * decks
+        self.cutCard = int(self.size * penetration)
+        self.rng = np.random.default_rng(rng)
+        self.cards = shuffleShoes(rows, decks, self.rng)
+        self.positions = np.zeros(rows, dtype=np.int64)
+        self.runningCounts = np.zeros(rows, dtype=np.int64)
+
+    def shuffle(self, rows):
+        if rows.size:
+            self.cards[rows] = shuffleShoes(rows.size, self.decks, self.rng)
+            self.positions[rows] = 0
+            self.runningCounts[rows] = 0
+
+    def startRound(self, rows):
+        self.shuffle(rows[self.positions[rows] >= self.cutCard])
+
+    def draw(self, rows):
+        """ Deals one card of every row of rows (which must not repeat), as values 1 to 10 like ai.drawCard. """
+
+        self.shuffle(rows[self.positions[rows] >= self.size])
+        cards = self.cards[rows, self.positions[rows]]
+        self.positions[rows] += 1
+        values = np.minimum(cards % 13 + 1, 10).astype(np.int64)
+        self.runningCounts[rows] += HI_LO_VALUES[values]
+        return values
+
+    def trueCounts(self, rows):
+        return self.runningCounts[rows] * 52.0 / np.maximum(self.size - self.positions[rows], 1)
+
+def dealerPlayShoes(total, hasAce, shoes, rows):
+    """ vectorq.dealerPlayBatch dealing from the shoes of rows. """
+
+    total = total.copy()
+    hasAce = hasAce.copy()
+    values = handTotals(total, hasAce)
+    drawing = np.flatnonzero(values < 17)
+    while drawing.size:
+        cards = shoes.draw(rows[drawing])
+        total[drawing] += cards
+        hasAce[drawing] |= (cards == 1)
+        values[drawing] = handTotals(total[drawing], hasAce[drawing])
+        drawing = drawing[values[drawing] < 17]
+    return values
+
+def playHands(policy, shoes, rows):
+    """ Plays one hand with the policy array of evaluate.policyArray on the shoe of every row of rows. Returns the
+    gain of every hand for a bet of 1. """
+
+    flatPolicy = policy.reshape(-1)
+    n = rows.size
+
+    # deal like engine.deckDeal, player, dealer, player, dealer
+    playerCard = shoes.draw(rows)
+    dealerCard = shoes.draw(rows)
+    playerTotal = playerCard + shoes.draw(rows)
+    holeCard = shoes.draw(rows)
+    playerAce = (playerCard == 1) | (playerTotal - playerCard == 1)
+    dealerTotal = dealerCard + holeCard
+    dealerAce = (dealerCard == 1) | (holeCard == 1)
+
+    playerNatural = handTotals(playerTotal, playerAce) == 21
+    dealerNatural = handTotals(dealerTotal, dealerAce) == 21
+    rewards = np.zeros(n)
+    rewards[playerNatural & ~dealerNatural] = 1.5
+    rewards[dealerNatural & ~playerNatural] = -1.0
+
+    active = np.flatnonzero(~(playerNatural | dealerNatural))
+    while active.size:
+        total = playerTotal[active]
+        useable = playerAce[active] & (total + 10 <= 21)
+        values = total + 10 * useable
+        hit = flatPolicy[((dealerCard[active] - 1) * PLAYER_TOTALS + (values - 2)) * 2 + useable]
+
+        # Player stands
+        stands = active[~hit]
+        if stands.size:
+            dealerValues = dealerPlayShoes(dealerTotal[stands], dealerAce[stands], shoes, rows[stands])
+            rewards[stands] = getRewardsByTotals(dealerValues, handTotals(playerTotal[stands], playerAce[stands]))
+
+        # Player hits
+        hits = active[hit]
+        if hits.size:
+            cards = shoes.draw(rows[hits])
+            playerTotal[hits] += cards
+            playerAce[hits] |= (cards == 1)
+            bust = handTotals(playerTotal[hits], playerAce[hits]) > 21
+            rewards[hits[bust]] = -1.0
+            hits = hits[~bust]
+        active = hits
+
+    return rewards
+
+def measureEdge(policySet, hands=1000000, decks=1, penetration=0.75, seed=None, batchSize=BATCH_SIZE):
+    """ Plays about hands hands of policySet for a bet of 1 and fits their gain as a line of the true count
+    before the deal. Returns an Edge. """
+
+    policy = policyArray(policySet)
+    shoes = Shoes(batchSize, decks, penetration, seed)
+    rows = np.arange(batchSize)
+    counts = []
+    gains = []
+    for n in range(0, max(1, -(-hands // batchSize))):
+        shoes.startRound(rows)
+        counts.append(shoes.trueCounts(rows))
+        gains.append(playHands(policy, shoes, rows))
+    counts = np.concatenate(counts)
+    gains = np.concatenate(gains)
+    edgePerCount, intercept = np.polyfit(counts, gains, 1)
+    return Edge(float(gains.mean()), float(intercept), float(edgePerCount), float(gains.var()))
+
+class FlatBet():
+    """ The same bet every hand, $10 like the game starts with. """
+
+    def __init__(self, bet=10.0):
+        self.bet = bet
+
+    def bets(self, bankroll, trueCount):
+        return np.full(bankroll.size, self.bet)
+
+class KellyBet():
+    """ fraction of the Kelly bet, edge / variance of the bankroll, with the edge at the true count taken from an
+    Edge of measureEdge. Without an edge it bets the table minimum. """
+
+    def __init__(self, edge, fraction=0.5):
+        self.edge = edge
+        self.fraction = fraction
+
+    def bets(self, bankroll, trueCount):
+        edge = self.edge.intercept + self.edge.edgePerCount * trueCount
+        return self.fraction * np.maximum(edge, 0.0) / self.edge.variance * bankroll
+
+class CountRamp():
+    """ unit times ramp[trueCount], the true count rounded down and clamped to the ramp, so the default bets one
+    unit up to a true count of 1 and eight units from 5 on. """
+
+    def __init__(self, unit=5.0, ramp=(1, 1, 2, 4, 6, 8)):
+        self.unit = unit
+        self.ramp = np.array(ramp, dtype=float)
+
+    def bets(self, bankroll, trueCount):
+        index = np.clip(np.floor(trueCount).astype(np.int64), 0, self.ramp.size - 1)
+        return self.unit * self.ramp[index]
+
+def clampBets(bets, bankroll, minBet=MIN_BET, betStep=BET_STEP):
+    """ Multiples of betStep of at least minBet, like the bet buttons, and never more than the bankroll, like
+    Game.endRound. """
+
+    bets = np.maximum(np.floor(bets / betStep) * betStep, minBet)
+    return np.minimum(bets, bankroll)
+
+def simulateBatch(policy, rule, n, shoes, funds=FUNDS, goal=GOAL, maxHands=MAX_HANDS):
+    """ Plays n trajectories together, one hand per step, until each is ruined, reaches goal or played maxHands.
+    Returns the hands played and the final bankroll of every trajectory. """
+
+    bankroll = np.full(n, float(funds))
+    hands = np.zeros(n, dtype=np.int64)
+    active = np.arange(n)
+    for hand in range(0, maxHands):
+        if not active.size:
+            break
+        shoes.startRound(active)
+        bets = clampBets(rule.bets(bankroll[active], shoes.trueCounts(active)), bankroll[active])
+        bankroll[active] += bets * playHands(policy, shoes, active)
+        hands[active] += 1
+        active = active[(bankroll[active] > 0) & (bankroll[active] < goal)]
+    return hands, bankroll
+
+def simulateShard(args):
+    """ Plays one worker's share of the trajectories in batches, used by simulateBankrolls. """
+
+    policy, rule, trajectories, funds, goal, decks, penetration, maxHands, seed, batchSize = args
+    rng = np.random.default_rng(seed)
+    hands = []
+    bankrolls = []
+    done = 0
+    while done < trajectories:
+        n = min(batchSize, trajectories - done)
+        shoes = Shoes(n, decks, penetration, rng)
+        batchHands, batchBankroll = simulateBatch(policy, rule, n, shoes, funds, goal, maxHands)
+        hands.append(batchHands)
+        bankrolls.append(batchBankroll)
+        done += n
+    return np.concatenate(hands), np.concatenate(bankrolls)
+
+def summarize(hands, bankroll, goal=GOAL):
+    """ The BankrollResult of the hands played and final bankrolls of the trajectories. """
+
+    n = hands.size
+    ruined = bankroll <= 0
+    reached = bankroll >= goal
+    finished = ruined | reached
+    riskOfRuin = np.count_nonzero(ruined) / n
+    return BankrollResult(
+        n, riskOfRuin, (riskOfRuin * (1 - riskOfRuin) / n) ** 0.5,
+        np.count_nonzero(reached) / n, 1 - np.count_nonzero(finished) / n,
+        float(hands[reached].mean()) if reached.any() else None,
+        float(hands[ruined].mean()) if ruined.any() else None,
+        dict(zip(PERCENTILES, np.percentile(hands[finished], PERCENTILES))) if finished.any() else {},
+        dict(zip(PERCENTILES, np.percentile(bankroll, PERCENTILES))))
+
+def simulateBankrolls(policySet, rule, trajectories=1000000, workers=None, funds=FUNDS, goal=GOAL, decks=1,
+                      penetration=0.75, maxHands=MAX_HANDS, seed=None, batchSize=BATCH_SIZE):
+    """ Plays trajectories sessions of policySet betting with rule and returns a BankrollResult.
+
+    The trajectories are split between workers processes (one per core by default), each with a random stream
+    spawned from seed, so the result only depends on seed and workers. """
+
+    workers = workers or os.cpu_count() or 1
+    policy = policyArray(policySet)
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    jobs = [(policy, rule, shard, funds, goal, decks, penetration, maxHands, seeds[w], batchSize)
+            for w, shard in enumerate(splitEvenly(trajectories, workers))]
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(simulateShard, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [simulateShard(job) for job in jobs]
+
+    hands = np.concatenate([shardHands for shardHands, shardBankroll in results])
+    bankroll = np.concatenate([shardBankroll for shardHands, shardBankroll in results])
+    return summarize(hands, bankroll, goal)
+
+def printBankrollResult(result):
+    print('%d trajectories' % result.trajectories)
+    print('risk of ruin %.4f +/- %.4f, goal %.4f, unfinished %.4f' % (result.riskOfRuin, result.riskOfRuinError,
+                                                                       result.goalRate, result.unfinishedRate))
+    for name, mean in [('goal', result.meanHandsToGoal), ('ruin', result.meanHandsToRuin)]:
+        if mean is not None:
+            print('hands to %s: %.1f on average' % (name, mean))
+    print('hands played   ' + ' '.join('p%d %6.0f' % item for item in sorted(result.handsPercentiles.items())))
+    print('final bankroll ' + ' '.join('p%d %6.1f' % item for item in sorted(result.bankrollPercentiles.items())))
+
+def test():
+    """ Checks the hands against their known odds and the bookkeeping on sessions decided in one hand, then
+    times the simulation. """
+
+    from ai import policyHelper
+    from solver import solveQMap
+    policySet = policyHelper(solveQMap())
+
+    edge = measureEdge(policySet, 2000000, seed=1)
+    print('edge %.4f per hand, %.4f per true count, variance %.3f' % (edge.meanGain, edge.edgePerCount,
+                                                                      edge.variance))
+    # a basic strategy without doubles and splits loses a couple of percent, and counting cards helps
+    assert -0.04 < edge.meanGain < 0.0, edge
+    assert edge.edgePerCount > 0, edge
+
+    # $10 on one hand to double $10: the session ends after the first hand that is not a push
+    result = simulateBankrolls(policySet, FlatBet(10), 200000, workers=1, funds=10, goal=20, seed=1)
+    assert result.unfinishedRate == 0 and abs(result.riskOfRuin + result.goalRate - 1) < 1e-12, result
+    assert result.handsPercentiles[5] == 1, result
+    assert result == simulateBankrolls(policySet, FlatBet(10), 200000, workers=1, funds=10, goal=20, seed=1)
+
+    start = time.perf_counter()
+    result = simulateBankrolls(policySet, FlatBet(10), 200000, seed=1)
+    seconds = time.perf_counter() - start
+    printBankrollResult(result)
+    print('%.0f trajectories/s' % (result.trajectories / seconds))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate bankroll trajectories of a policy and a bet rule.')
+    parser.add_argument('--rule', choices=['flat', 'kelly', 'ramp'], default='flat')
+    parser.add_argument('--policy', choices=['exact', 'learned'], default='exact',
+                        help='the exact policy of solver.py, or the learned one of ai.getPolicySet')
+    parser.add_argument('--trajectories', type=int, default=1000000)
+    parser.add_argument('--bet', type=float, default=10.0, help='bet of the flat rule')
+    parser.add_argument('--unit', type=float, default=MIN_BET, help='betting unit of the count ramp')
+    parser.add_argument('--fraction', type=float, default=0.5, help='Kelly fraction')
+    parser.add_argument('--funds', type=float, default=FUNDS)
+    parser.add_argument('--goal', type=float, default=GOAL)
+    parser.add_argument('--decks', type=int, default=1)
+    parser.add_argument('--penetration', type=float, default=0.75)
+    parser.add_argument('--max-hands', type=int, default=MAX_HANDS)
+    parser.add_argument('--workers', type=int, default=None, help='processes, one per core by default')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.policy == 'exact':
+        from ai import policyHelper
+        from solver import solveQMap
+        policySet = policyHelper(solveQMap())
+    else:
+        from ai import getPolicySet
+        policySet = getPolicySet()
+
+    if args.rule == 'flat':
+        rule = FlatBet(args.bet)
+    elif args.rule == 'ramp':
+        rule = CountRamp(args.unit)
+    else:
+        edge = measureEdge(policySet, decks=args.decks, penetration=args.penetration, seed=args.seed)
+        print('edge %.4f per hand, %.4f per true count, variance %.3f' % (edge.meanGain, edge.edgePerCount,
+                                                                          edge.variance))
+        rule = KellyBet(edge, args.fraction)
+
+    start = time.perf_counter()
+    result = simulateBankrolls(policySet, rule, args.trajectories, args.workers, args.funds, args.goal, args.decks,
+                               args.penetration, args.max_hands, args.seed)
+    printBankrollResult(result)
+    print('%.1f s' % (time.perf_counter() - start))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import ai
+from dealertable import buildDealerTable, sampleDealerHand
+from shoe import Shoe
+from solver import policyAgreement
+from utils import createDeck, getRandom, shuffle, shuffleShoes
+
+"""
+Benchmarks of the ai training and evaluation hot paths.
+
+For every training engine and card model it measures episodes per second, the
+peak memory of a run (with tracemalloc, in a separate smaller run so tracing
+does not slow down the timed one) and the time it takes until the learned
+policy agrees with the exact policy of solver.py. It also times the small
+functions every episode goes through and the two policy evaluators.
+
+Each run appends one JSON line to the output file, with the git commit it ran
+on, so results can be compared across commits:
+
+    python benchmark.py --quick
+    python benchmark.py --output results.jsonl
+"""
+
+DEFAULT_OUTPUT = 'benchmark-results.jsonl'
+
+# settings for the quick mode (well under a minute) and the full one
+SIZES = {
+    True: {'calls': 100000, 'episodes': 100000, 'vectorEpisodes': 1000000, 'hands': 100000,
+           'vectorHands': 2000000, 'memoryEpisodes': 20000, 'maxConvergence': 400000},
+    False: {'calls': 1000000, 'episodes': 1000000, 'vectorEpisodes': 10000000, 'hands': 1000000,
+            'vectorHands': 20000000, 'memoryEpisodes': 100000, 'maxConvergence': 8000000},
+}
+
+# a policy has converged when it agrees with the exact policy on this share of the states
+AGREEMENT = 0.97
+ALPHA = 1
+DISCOUNT = 1
+EPSILON = 0.1
+
+def timeIt(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+def peakMemory(function, *args):
+    """ Peak memory in bytes allocated while running function, as seen by tracemalloc. """
+
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def callsPerSecond(function, calls):
+    start = time.perf_counter()
+    for n in range(0, calls):
+        function()
+    return calls / (time.perf_counter() - start)
+
+def getEngines():
+    """ Returns (name, train) pairs, train(episodes) returns a qMap. """
+
+    from vectorq import q_learning_vectorized, q_learning_parallel, qArrayToMap
+    from counting import q_learning_counting
+    table = buildDealerTable()
+    workers = os.cpu_count() or 1
+    return [
+        ('python-infinite', lambda n: ai.q_learning(n, ALPHA, DISCOUNT, EPSILON)),
+        ('python-dealer-table', lambda n: ai.q_learning(n, ALPHA, DISCOUNT, EPSILON, dealerTable=table)),
+        ('python-shoe-6', lambda n: ai.q_learning(n, ALPHA, DISCOUNT, EPSILON, shoe=Shoe(6, seed=1))),
+        # count aware learning is compared on its zero count bucket
+        ('counting-shoe-6',
+         lambda n: q_learning_counting(n, ALPHA, DISCOUNT, EPSILON, Shoe(6, seed=1)).qMap(0)),
+        ('vectorized-infinite', lambda n: qArrayToMap(q_learning_vectorized(n, ALPHA, DISCOUNT, EPSILON, seed=1))),
+        ('parallel-%d-infinite' % workers,
+         lambda n: qArrayToMap(q_learning_parallel(n, workers, ALPHA, DISCOUNT, EPSILON, seed=1))),
+    ]
+
+def benchmarkFunctions(sizes):
+    calls = sizes['calls']
+    shoe = Shoe(6, seed=1)
+    table = buildDealerTable()
+    hand = (10, False)
+    deck = createDeck()
+    rng = getRandom(1)
+    generator = np.random.default_rng(1)
+    return {
+        'drawCard': callsPerSecond(ai.drawCard, calls),
+        'Shoe.draw': callsPerSecond(shoe.draw, calls),
+        'getHandTotal': callsPerSecond(lambda: ai.getHandTotal(hand), calls),
+        'dealerPlay': callsPerSecond(lambda: ai.dealerPlay(hand), calls),
+        'dealerPlay-shoe': callsPerSecond(lambda: ai.dealerPlay(hand, shoe), calls),
+        'sampleDealerHand': callsPerSecond(lambda: sampleDealerHand(table, hand), calls),
+        'shuffle': callsPerSecond(lambda: shuffle(deck, rng), calls // 10),
+        # decks shuffled per second, 1000 at a time
+        'shuffleShoes': 1000 * callsPerSecond(lambda: shuffleShoes(1000, seed=generator), calls // 1000),
+    }
+
+def benchmarkTraining(sizes, exactPolicySet):
+    results = {}
+    for name, train in getEngines():
+        vectorized = name.startswith('vectorized') or name.startswith('parallel')
+        episodes = sizes['vectorEpisodes'] if vectorized else sizes['episodes']
+        seconds, qMap = timeIt(train, episodes)
+
+        # time to convergence, doubling the episodes until the policy agrees with the exact one
+        convergence = None
+        n = 10000
+        while n <= sizes['maxConvergence']:
+            convergenceSeconds, convergenceQ = timeIt(train, n)
+            if policyAgreement(ai.policyHelper(convergenceQ), exactPolicySet) >= AGREEMENT:
+                convergence = {'episodes': n, 'seconds': convergenceSeconds}
+                break
+            n *= 2
+
+        results[name] = {
+            'episodes': episodes,
+            'episodesPerSecond': episodes / seconds,
+            'peakMemoryBytes': peakMemory(train, sizes['memoryEpisodes']),
+            'agreement': policyAgreement(ai.policyHelper(qMap), exactPolicySet),
+            'convergence': convergence,
+        }
+        print('%-22s %12.0f episodes/s' % (name, results[name]['episodesPerSecond']))
+    return results
+
+def benchmarkEvaluation(sizes, exactQ):
+    from evaluate import evaluatePolicy
+    policySet = ai.policyHelper(exactQ)
+    results = {}
+
+    hands = sizes['hands']
+    seconds, result = timeIt(lambda: ai.q_learning_test_print_average(exactQ, hands))
+    results['python'] = {'hands': hands, 'handsPerSecond': hands / seconds}
+
+    hands = sizes['vectorHands']
+    seconds, result = timeIt(evaluatePolicy, policySet, hands)
+    results['vectorized'] = {'hands': hands, 'handsPerSecond': hands / seconds,
+                             'peakMemoryBytes': peakMemory(evaluatePolicy, policySet, sizes['hands'])}
+    for name, values in results.items():
+        print('%-22s %12.0f hands/s' % ('evaluate-' + name, values['handsPerSecond']))
+    return results
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ai training and evaluation hot paths.')
+    parser.add_argument('--quick', action='store_true', help='small sizes, runs in under a minute')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='JSON lines file the results are appended to')
+    args = parser.parse_args(argv)
+
+    from solver import solveQMap
+    random.seed(1)
+    sizes = SIZES[args.quick]
+    start = time.perf_counter()
+    exactSeconds, exactQ = timeIt(solveQMap)
+    exactPolicySet = ai.policyHelper(exactQ)
+
+    record = {
+        'commit': gitCommit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'quick': args.quick,
+        'exactSolverSeconds': exactSeconds,
+        'functionsPerSecond': benchmarkFunctions(sizes),
+        'training': benchmarkTraining(sizes, exactPolicySet),
+        'evaluation': benchmarkEvaluation(sizes, exactQ),
+    }
+    record['totalSeconds'] = time.perf_counter() - start
+
+    with open(args.output, 'a') as f:
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+    print('results appended to %s (%.1fs)' % (args.output, record['totalSeconds']))
+
+if __name__ == '__main__':
+    sys.exit(main())
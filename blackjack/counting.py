@@ -0,0 +1,170 @@
+from array import array
+from ai import getAllPossibleStates, initializeQMap, policyHelper, dealPlayer, dealDealer, addCardToHand, \
+    drawCard, dealerPlay, getHandTotal, getNextState, getRewardByHands
+from shoe import Shoe
+
+"""
+Card counting aware Q learning.
+
+With a finite shoe the best action also depends on the cards already played,
+so the state is extended to (dealerCard, playerTotal, hasUseableAce, countBucket)
+where countBucket is the shoe's true count rounded and clamped to
+[-MAX_BUCKET, MAX_BUCKET].
+
+The Q values and counters live in a QStore: one flat array of doubles per count
+bucket, allocated the first time that bucket is seen. A bucket takes the same
+880 entries as the qMap of ai.q_learning, so memory stays bounded by the number
+of buckets no matter how many episodes are played.
+"""
+
+MAX_BUCKET = 5
+
+DEALER_CARDS = 11
+PLAYER_TOTALS = 20
+BUCKET_SIZE = DEALER_CARDS * PLAYER_TOTALS * 2 * 2
+
+def stateIndex(state):
+    """ Index of the stand value of state in a bucket, the hit value is the next one. """
+
+    dealerCard, playerTotal, hasUseableAce = state
+    return (((dealerCard - 1) * PLAYER_TOTALS + (playerTotal - 2)) * 2 + hasUseableAce) * 2
+
+def getCountBucket(trueCount):
+    return max(-MAX_BUCKET, min(MAX_BUCKET, int(round(trueCount))))
+
+def buildInitialBucket():
+    """ The initial values of ai.initializeQMap laid out as a bucket. """
+
+    values = array('d', bytes(8 * BUCKET_SIZE))
+    for (state, action), value in initializeQMap().items():
+        values[stateIndex(state) + action] = value
+    return values
+
+class QStore():
+    """ Q values and counters of every count bucket, allocated lazily. """
+
+    def __init__(self):
+        self.initial = buildInitialBucket()
+        self.buckets = {}
+
+    def getBucket(self, bucket):
+        """ Returns the (qValues, counters) arrays of bucket, creating them the first time. """
+
+        arrays = self.buckets.get(bucket)
+        if arrays is None:
+            arrays = (array('d', self.initial), array('d', bytes(8 * BUCKET_SIZE)))
+            self.buckets[bucket] = arrays
+        return arrays
+
+    def qMap(self, bucket):
+        """ The Q values of bucket in the qMap format of ai.q_learning. """
+
+        qValues = self.getBucket(bucket)[0]
+        qMap = {}
+        for state in getAllPossibleStates():
+            index = stateIndex(state)
+            qMap[(state, True)] = qValues[index + 1]
+            qMap[(state, False)] = qValues[index]
+        return qMap
+
+# Q learning.
+def q_learning_counting(learningTimes, alpha, discount, epsilon, shoe, store=None):
+    """ Same update rule as ai.q_learning, but every round is really dealt from shoe and the count bucket is
+    part of the state. Returns the QStore. """
+
+    if store is None:
+        store = QStore()
+    rand = shoe.random.random
+    for n in range(0, learningTimes):
+        shoe.startRound()
+        playerHand = dealPlayer(shoe)
+        dealerCard, dealerHand = dealDealer(shoe)
+        qValues, counters = store.getBucket(getCountBucket(shoe.trueCount()))
+        index = stateIndex(getNextState(dealerCard, playerHand))
+        while True:
+            # epsilon greedy, ties go to stand like ai.getBestActionByQ
+            if rand() < epsilon:
+                action = rand() < 0.5
+            else:
+                action = qValues[index + 1] > qValues[index]
+            pair = index + action
+            counters[pair] += 1.0
+            # Player hits
+            if action:
+                playerHand = addCardToHand(drawCard(shoe), playerHand)
+                # Player does not bust
+                if getHandTotal(playerHand) <= 21:
+                    nextQValues, nextCounters = store.getBucket(getCountBucket(shoe.trueCount()))
+                    nextIndex = stateIndex(getNextState(dealerCard, playerHand))
+                    maxQ = max(nextQValues[nextIndex], nextQValues[nextIndex + 1])
+                    qValues[pair] += alpha / counters[pair] * (discount * maxQ - qValues[pair])
+                    qValues, counters, index = nextQValues, nextCounters, nextIndex
+                # Player busts
+                else:
+                    qValues[pair] += alpha / counters[pair] * (-1 - qValues[pair])
+                    break
+            # Player stands
+            else:
+                dealerHand = dealerPlay(dealerHand, shoe)
+                qValues[pair] += alpha / counters[pair] * (getRewardByHands(dealerHand, playerHand) - qValues[pair])
+                break
+    return store
+
+def countPolicyHelper(store):
+    """ Returns a dict mapping every count bucket in store to a policySet like ai.policyHelper returns. """
+
+    return dict((bucket, policyHelper(store.qMap(bucket))) for bucket in store.buckets)
+
+def cachedQStore(params, train):
+    """ Returns the QStore for params from policycache, or calls train() to get it and caches it. The Q values of
+    every bucket are saved as one row, with NaN rows for the buckets that were never seen. The counters are not
+    saved, a loaded store is for playing, not for more training. """
+
+    import numpy as np
+    from policycache import loadArray, saveArray
+    shape = (2 * MAX_BUCKET + 1, BUCKET_SIZE)
+    rows = loadArray(params, shape, 'count')
+    if rows is not None:
+        store = QStore()
+        for bucket in range(-MAX_BUCKET, MAX_BUCKET + 1):
+            row = rows[bucket + MAX_BUCKET]
+            if not np.isnan(row[0]):
+                store.getBucket(bucket)[0][:] = array('d', row.tobytes())
+        return store
+    store = train()
+    rows = np.full(shape, np.nan)
+    for bucket, (qValues, counters) in store.buckets.items():
+        rows[bucket + MAX_BUCKET] = qValues
+    saveArray(params, rows, 'count')
+    return store
+
+def getCountPolicySet(decks=1, n_iter_q=3500000, alpha=1, discount=1, epsilon=0.1, seed=None, useCache=True,
+                      progress=None, checkpointTimes=100000):
+    # progress is called with (episodes, maxEpisodes) every checkpointTimes episodes while training
+    params = {'n_iter': n_iter_q, 'alpha': alpha, 'epsilon': epsilon, 'discount': discount, 'deck': '%d decks' % decks,
+              'seed': seed}
+
+    def train():
+        print('Q-LEARNING -- %d DECK SHOE WITH COUNT' % decks)
+        # learning in chunks on the same store and shoe learns exactly what a single run would
+        shoe = Shoe(decks, seed=seed)
+        store = QStore()
+        for done in range(0, n_iter_q, checkpointTimes):
+            q_learning_counting(min(checkpointTimes, n_iter_q - done), alpha, discount, epsilon, shoe, store)
+            if progress is not None:
+                progress(min(done + checkpointTimes, n_iter_q), n_iter_q)
+        return store
+
+    store = cachedQStore(params, train) if useCache else train()
+    return countPolicyHelper(store)
+
+def cardValue(card):
+    """ Value (1 to 10) of a card of the game (an int of utils.py). """
+
+    return min(card % 13 + 1, 10)
+
+def countBucketOfDeck(runningCount, cardsLeft):
+    """ Count bucket of the game's deck, given the running count of the cards seen since the last shuffle (see
+    engine.Game.runningCount) and the number of cards left in the deck. """
+
+    return getCountBucket(runningCount * 52.0 / max(cardsLeft, 1))
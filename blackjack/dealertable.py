@@ -0,0 +1,73 @@
+import bisect
+import random
+from ai import addCardToHand, dealerPlay, getHandTotal
+from solver import dealerOutcomeDistribution, BUST
+
+"""
+Lookup table for the dealer's final total, used instead of simulating ai.dealerPlay.
+
+For every dealer hand (total, hasAce) the table stores the possible final totals
+(17 to 21, or BUST) and their cumulative probabilities, computed exactly by
+solver.dealerOutcomeDistribution. Sampling the dealer's final hand is then one
+random.random() and a binary search, no matter how many cards the dealer would
+have drawn.
+
+It assumes the infinite deck of ai.drawCard.
+"""
+
+def buildDealerTable():
+    """ Returns a dict mapping every dealer hand reachable from one up card to (finalTotals, cumulative). """
+
+    memo = {}
+    for dealerCard in range(1, 12):
+        dealerOutcomeDistribution(addCardToHand(dealerCard, (0, False)), memo)
+
+    table = {}
+    for hand, distribution in memo.items():
+        finalTotals = sorted(distribution)
+        cumulative = []
+        total = 0.0
+        for final in finalTotals:
+            total += distribution[final]
+            cumulative.append(total)
+        # make sure the last bucket catches random() values that rounding would leave out
+        cumulative[-1] = 1.0
+        table[hand] = (finalTotals, cumulative)
+    return table
+
+def sampleDealerHand(table, hand):
+    """ Same as ai.dealerPlay(hand), but sampled from the table. The returned hand has no ace, so
+    getHandTotal of it is the final total (BUST for every total over 21). """
+
+    entry = table.get(hand)
+    if entry is None:
+        # not reachable from a single up card, simulate it
+        return dealerPlay(hand)
+    finalTotals, cumulative = entry
+    return (finalTotals[bisect.bisect_right(cumulative, random.random())], False)
+
+def test():
+    """ Checks that sampling from the table gives the same distribution as simulating dealerPlay. """
+
+    n_times = 200000
+    table = buildDealerTable()
+    for dealerCard in range(1, 11):
+        hand = addCardToHand(dealerCard, (0, False))
+        simulated = {}
+        sampled = {}
+        for n in range(0, n_times):
+            final = min(getHandTotal(dealerPlay(hand)), BUST)
+            simulated[final] = simulated.get(final, 0) + 1
+            final = getHandTotal(sampleDealerHand(table, hand))
+            sampled[final] = sampled.get(final, 0) + 1
+
+        exact = dealerOutcomeDistribution(hand)
+        for final, probability in exact.items():
+            # both frequencies must be within 5 standard deviations of the exact probability
+            limit = 5 * (probability * (1 - probability) / n_times) ** 0.5
+            assert abs(simulated.get(final, 0) / n_times - probability) < limit, (dealerCard, final, 'simulated')
+            assert abs(sampled.get(final, 0) / n_times - probability) < limit, (dealerCard, final, 'sampled')
+        print('dealer card %2d ok' % dealerCard)
+
+if __name__ == '__main__':
+    test()
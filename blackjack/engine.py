@@ -0,0 +1,377 @@
+import math
+import random
+from utils import Deck, CARD_POINTS, HI_LO_POINTS, isAce, getRandom
+
+"""
+The rules of the game, without pygame.
+
+The deck functions and checkValue used to live inside blackjack.mainGame. Game
+holds the state of a whole session (deck, hands, funds, bet and rounds played)
+and plays it with deal, hit, stand, double and the bet buttons, following
+exactly what the buttons of the pygame front end do. The front end only draws
+a Game, so the same rules can be run headless for simulations.
+
+Cards are the ints of utils.py and the deck is a utils.Deck, which is only
+reshuffled at the start of a round once its cut card has been reached.
+"""
+
+######## DECK FUNCTIONS ########
+def deckDeal(deck):
+    """ Takes the top 4 cards off the deck, appends them to the player's and dealer's hands, and returns the
+    player's and dealer's hands. """
+
+    dealerHand, playerHand = Hand(), Hand()
+
+    cardsToDeal = 4
+
+    while cardsToDeal > 0:
+        # deal the first card to the player, second to dealer, 3rd to player, 4th to dealer,
+        # based on divisibility
+        if cardsToDeal % 2 == 0:
+            playerHand.append(deck.draw())
+        else:
+            dealerHand.append(deck.draw())
+
+        cardsToDeal -= 1
+
+    return playerHand, dealerHand
+
+def hit(deck, hand):
+    """ Gives a card to the player if the player is hitting, or to the dealer if the dealer is hitting. The deck
+    shuffles its dead deck back in by itself when it is empty. """
+
+    hand.append(deck.draw())
+
+    return hand
+
+def checkValue(hand):
+    """ Checks the value of the cards in the player's or dealer's hand. """
+
+    totalValue = 0
+    aceCount = 0
+    aceFlag = True
+
+    for card in hand:
+        # Jacks, kings and queens are all worth 10, and ace is worth 11
+        totalValue += CARD_POINTS[card]
+        if isAce(card):
+            aceCount += 1
+
+    # check the special case where ace represents 1
+    if totalValue > 21:
+        for card in hand:
+            # If the player would bust and he has an ace in his hand, the ace's value is diminished by 10
+            # In situations where there are multiple aces in the hand, this checks to see if the total value
+            # would still be over 21 if the second ace wasn't changed to a value of one. If it's under 21,
+            # there's no need to change the value of the second ace, so the loop breaks.
+            if isAce(card):
+                totalValue -= 10
+                aceCount -= 1
+
+            if totalValue <= 21:
+                if aceCount == 0:
+                    aceFlag = False
+                else:
+                    aceFlag = True
+                break
+            else:
+                continue
+
+    return totalValue, aceFlag
+
+class Hand(list):
+    """ The cards of a hand, keeping the total (aces counting 11) and the number of aces up to date as cards are
+    appended, so value() costs the same however many cards there are. Cards must only be added with append.
+
+    value() follows checkValue exactly: when the hand is over 21, only as many aces as needed count 1 instead of
+    11, and the ace flag tells whether an ace still counts 11. The flag is True when the hand is 21 or under
+    without any ace turned to 1, and when the hand busts even with every ace counting 1. """
+
+    def __init__(self, cards=()):
+        list.__init__(self)
+        self.points = 0
+        self.aces = 0
+        for card in cards:
+            self.append(card)
+
+    def append(self, card):
+        list.append(self, card)
+        self.points += CARD_POINTS[card]
+        if isAce(card):
+            self.aces += 1
+
+    def value(self):
+        """ Returns (totalValue, aceFlag) like checkValue. """
+
+        if self.points <= 21:
+            return self.points, True
+        # number of aces that have to count 1 for the hand to be 21 or under
+        needed = (self.points - 12) // 10
+        if needed > self.aces:
+            return self.points - 10 * self.aces, True
+        return self.points - 10 * needed, needed < self.aces
+
+    def softAces(self):
+        """ Number of aces still counting 11. """
+
+        if self.points <= 21:
+            return self.aces
+        return max(self.aces - (self.points - 12) // 10, 0)
+
+    def isBlackjack(self):
+        return len(self) == 2 and self.points == 21
+
+class Game():
+    """ A session at the table. roundEnd is 1 in between rounds and 0 while the cards are dealt, like in the
+    front end. message is the sentence to show the player, None until there is one. When a round ends, the
+    hands are moved to the dead deck and kept in lastPlayerHand and lastDealerHand so they can be shown. With a
+    seed (or a random.Random), the deck is shuffled by its own generator and the game can be played again exactly. """
+
+    def __init__(self, funds=100.00, bet=10.00, decks=1, penetration=0.75, seed=None):
+        # The deck of 52 cards (per deck), it keeps the cards that have been discarded too
+        self.deck = Deck(decks, penetration, getRandom(seed) if seed is not None else random)
+        self.playerHand = Hand()
+        self.dealerHand = Hand()
+        self.lastPlayerHand = Hand()
+        self.lastDealerHand = Hand()
+        self.funds = funds
+        self.bet = bet
+        self.handsPlayed = 0
+        self.roundEnd = 1
+        self.message = None
+        self.gameOver = False
+        # money won (positive) or lost (negative) in the last round
+        self.lastGain = 0.0
+        # deck.shuffles when the dealer's hole card was dealt, see runningCount
+        self.holeCardShuffle = None
+
+    def betUp(self):
+        """ Increases the bet by 5 (in between hands only), never over the funds. """
+
+        if self.roundEnd == 1 and self.bet < self.funds:
+            # If the bet is not a multiple of 5, it goes up to the next multiple of 5. This can only happen when
+            # the player has gotten blackjack, and has funds that are not divisible by 5, then loses money,
+            # and has a bet higher than his funds, so the bet is pulled down to the funds, which can be fractional.
+            self.bet = min(self.funds, math.floor(self.bet / 5) * 5 + 5.0)
+
+    def betDown(self):
+        """ Decreases the bet by 5 (in between hands only), never over the funds. """
+
+        if self.roundEnd == 1 and self.bet > 5:
+            # an uneven bet goes down to the multiple of 5 under it, like betUp
+            self.bet = min(self.funds, max(5.0, math.ceil(self.bet / 5) * 5 - 5.0))
+
+    def canDouble(self):
+        return self.roundEnd == 0 and self.funds >= self.bet * 2 and len(self.playerHand) == 2
+
+    def deal(self):
+        """ Deals a new round if the last one is over, shuffling the deck first once the cut card is reached. """
+
+        if self.roundEnd != 1:
+            return
+        self.deck.startRound()
+        self.message = ""
+        self.playerHand, self.dealerHand = deckDeal(self.deck)
+        self.holeCardShuffle = self.deck.shuffles
+        self.roundEnd = 0
+        self.handsPlayed += 1
+        self.checkHands()
+
+    def hit(self):
+        """ Gives the player another card. """
+
+        if self.roundEnd != 0:
+            return
+        self.playerHand = hit(self.deck, self.playerHand)
+        self.checkHands()
+
+    def stand(self):
+        """ The player takes no more cards, the dealer plays and the hands are compared. """
+
+        if self.roundEnd != 0:
+            return
+        self.compareHands(self.bet)
+
+    def double(self):
+        """ Doubles the bet for this round, takes one more card, then stands. """
+
+        if not self.canDouble():
+            return
+        self.playerHand = hit(self.deck, self.playerHand)
+        self.compareHands(self.bet * 2)
+
+    def seenCards(self):
+        """ The cards dealt since the last shuffle that the player has seen, that is all but the dealer's hole card
+        while the round is being played. """
+
+        seen = self.deck.dealt()
+        if self.roundEnd == 0 and self.dealerHand[1] in seen:
+            seen.remove(self.dealerHand[1])
+        return seen
+
+    def runningCount(self):
+        """ Hi-Lo running count of seenCards(), from the count the deck keeps, so it costs the same however many
+        cards were dealt. """
+
+        runningCount = self.deck.runningCount
+        if self.roundEnd == 0 and self.holeCardShuffle == self.deck.shuffles:
+            runningCount -= HI_LO_POINTS[self.dealerHand[1]]
+        return runningCount
+
+    def checkHands(self):
+        """ Checks for blackjack and for the player busting, after the cards are dealt and after every hit. """
+
+        if self.roundEnd != 0:
+            return
+        playerValue, playerAceFlag = self.playerHand.value()
+        dealerValue, dealerAceFlag = self.dealerHand.value()
+
+        if self.playerHand.isBlackjack():
+            # If the player gets blackjack
+            self.blackJack()
+        elif self.dealerHand.isBlackjack():
+            # If the dealer has blackjack
+            self.blackJack()
+        elif playerValue > 21:
+            # If player busts
+            self.message = "You bust! You lost $%.2f." % self.bet
+            self.endRound(0, self.bet)
+
+    def blackJack(self):
+        """ Called when the player or the dealer is determined to have blackjack. Hands are compared to
+        determine the outcome. """
+
+        playerValue, playerAceFlag = self.playerHand.value()
+        dealerValue, dealerAceFlag = self.dealerHand.value()
+
+        if playerValue == 21 and dealerValue == 21:
+            # The opposing player ties the original blackjack getter because he also has blackjack
+            self.message = "Blackjack! The dealer also has blackjack, another round"
+            self.endRound(0, self.bet)
+        elif playerValue == 21 and dealerValue != 21:
+            # Dealer loses
+            self.message = "Blackjack! You won $%.2f." % (self.bet * 1.5)
+            self.endRound(self.bet, 0)
+        elif dealerValue == 21 and playerValue != 21:
+            # Player loses, money is lost, and new hand will be dealt
+            self.message = "Dealer has blackjack! You lose $%.2f." % self.bet
+            self.endRound(0, self.bet)
+
+    def compareHands(self, bet):
+        """ Called at the end of a round (after the player stands). The dealer hits until 17, then the values of
+        the hands are compared to determine who wins the round based on the rules of blackjack. """
+
+        dealerValue, dealerAceFlag = self.dealerHand.value()
+        playerValue, playerAceFlag = self.playerHand.value()
+
+        # Dealer hits until he has 17 or over
+        while dealerValue < 17:
+            self.dealerHand = hit(self.deck, self.dealerHand)
+            dealerValue, dealerAceFlag = self.dealerHand.value()
+
+        if playerValue > dealerValue and playerValue <= 21:
+            # Player has beaten the dealer, and hasn't busted, therefore WINS
+            self.message = "You won $%.2f." % bet
+            self.endRound(bet, 0)
+        elif playerValue == dealerValue and playerValue <= 21:
+            # Tie
+            self.message = "It's a tie, another round!"
+            self.endRound(0, 0)
+        elif dealerValue > 21 and playerValue <= 21:
+            # Dealer has busted and player hasn't
+            self.message = "Dealer busts! You won $%.2f." % bet
+            self.endRound(bet, 0)
+        else:
+            # Dealer wins in every other situation
+            self.message = "Dealer wins! You lost $%.2f." % bet
+            self.endRound(0, bet)
+
+    def endRound(self, moneyGained, moneyLost):
+        """ Called at the end of a round to move the cards to the dead deck and pay the money gained or lost. """
+
+        playerHand = self.playerHand
+        if len(playerHand) == 2 and isAce(playerHand[0]) or isAce(playerHand[1]):
+            # If the player has blackjack, pay his bet back 3:2
+            moneyGained += moneyGained / 2.0
+
+        self.lastPlayerHand = playerHand
+        self.lastDealerHand = self.dealerHand
+
+        # Remove the cards from the player's and dealer's hands
+        self.deck.discard(playerHand)
+        self.deck.discard(self.dealerHand)
+        self.playerHand = Hand()
+        self.dealerHand = Hand()
+
+        self.funds += moneyGained
+        self.funds -= moneyLost
+        self.lastGain = moneyGained - moneyLost
+        if self.funds <= 0 or self.funds >= 200:
+            self.gameOver = True
+        elif self.bet > self.funds:
+            # If you lost money, and your bet is greater than your funds, make the bet equal to the funds
+            self.bet = self.funds
+
+        self.roundEnd = 1
+
+def test():
+    """ Checks that Hand.value gives the same results as checkValue on random hands, with many aces, and that it
+    is faster, and that the bet buttons keep the bet a multiple of 5 within the funds. """
+
+    import time
+    rng = random.Random(1)
+    aces = [card for card in range(0, 52) if isAce(card)]
+    hands = []
+    for n in range(0, 200000):
+        size = rng.randint(1, 9)
+        # every other hand is mostly aces, to cover hands with several of them
+        if n % 2:
+            cards = [rng.choice(aces) if rng.random() < 0.6 else rng.randrange(52) for card in range(0, size)]
+        else:
+            cards = [rng.randrange(52) for card in range(0, size)]
+        hands.append(cards)
+
+    for cards in hands:
+        hand = Hand()
+        for n in range(0, len(cards)):
+            hand.append(cards[n])
+            assert hand.value() == checkValue(cards[0:n + 1]), cards[0:n + 1]
+        assert hand.isBlackjack() == (len(cards) == 2 and checkValue(cards)[0] == 21), cards
+    print('Hand.value matches checkValue on %d hands' % len(hands))
+
+    handObjects = [Hand(cards) for cards in hands]
+    start = time.perf_counter()
+    for cards in hands:
+        checkValue(cards)
+    checkSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for hand in handObjects:
+        hand.value()
+    print('value() is %.1fx faster than checkValue' % (checkSeconds / (time.perf_counter() - start)))
+
+    # uneven funds and bets are left by 3:2 payouts
+    for funds, bet, button, expected in [(107.5, 105.0, Game.betUp, 107.5), (107.5, 107.5, Game.betUp, 107.5),
+                                         (107.5, 107.5, Game.betDown, 105.0), (102.5, 97.5, Game.betUp, 100.0),
+                                         (7.5, 7.5, Game.betDown, 5.0), (3.0, 3.0, Game.betDown, 3.0),
+                                         (100.0, 95.0, Game.betUp, 100.0), (100.0, 10.0, Game.betDown, 5.0)]:
+        game = Game(funds, bet, seed=1)
+        button(game)
+        assert game.bet == expected, (funds, bet, button.__name__, game.bet)
+        assert game.bet <= game.funds
+    print('the bet buttons keep the bet within the funds')
+
+    # a cut card at the end of the deck makes it run out in the middle of rounds too
+    for penetration in (0.75, 1.0):
+        game = Game(funds=1e9, penetration=penetration, seed=1)
+        for n in range(0, 20000):
+            if game.roundEnd == 1:
+                game.deal()
+            elif rng.random() < 0.6:
+                game.hit()
+            else:
+                game.stand()
+            assert game.runningCount() == sum(HI_LO_POINTS[card] for card in game.seenCards())
+    print('runningCount matches the count of seenCards')
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,135 @@
+import collections
+import numpy as np
+from policytable import PolicyTable
+from vectorq import DEALER_CARDS, PLAYER_TOTALS, drawCards, handTotals, dealerPlayBatch, getRewardsByTotals
+
+"""
+Batched evaluation of a policy, the fast replacement of ai.q_learning_test_print_average.
+
+The hands are played exactly like q_learning_test_print_average plays them
+(two cards for the player, one for the dealer, the player follows the policy
+and the dealer draws to 17 on stand) but a whole batch at a time with numpy.
+
+A policy is the policySet returned by ai.policyHelper, or its PolicyTable of
+policytable.py. Internally it is turned into a boolean array indexed by
+[dealerCard - 1, playerTotal - 2, hasUseableAce] where True means hit.
+"""
+
+EvaluationResult = collections.namedtuple('EvaluationResult', [
+    'hands',                # number of hands played
+    'meanGain',             # average reward per hand
+    'standardError',        # standard error of meanGain
+    'confidenceInterval',   # (low, high) interval of meanGain at the requested confidence
+    'winRate',
+    'pushRate',
+    'lossRate',             # losses where the player did not bust
+    'bustRate',
+    'stateVisits',          # array of decisions made in each [dealerCard - 1, playerTotal - 2, hasUseableAce]
+])
+
+BATCH_SIZE = 65536
+
+# two sided normal quantiles for the usual confidence levels
+Z_SCORES = {0.9: 1.6449, 0.95: 1.9600, 0.99: 2.5758}
+
+def policyArray(policySet):
+    """ Turns a policySet of ai.policyHelper, or a PolicyTable, into the boolean hit array used here. """
+
+    policy = np.zeros((DEALER_CARDS, PLAYER_TOTALS, 2), dtype=bool)
+    if isinstance(policySet, PolicyTable):
+        table = policySet.toArray()
+        policy[:table.shape[0]] = table
+        return policy
+    for hasUseableAce, table in [(True, policySet[0]), (False, policySet[1])]:
+        for (card, val), hit in table.items():
+            policy[card - 1, val - 2, int(hasUseableAce)] = hit
+    return policy
+
+def playBatch(policy, n, rng, visits):
+    """ Plays n hands with the policy array, adds the decisions to visits and returns the rewards and a
+    mask of the hands where the player busted. """
+
+    flatPolicy = policy.reshape(-1)
+    flatVisits = visits.reshape(-1)
+
+    # dealPlayer and dealDealer
+    cards = drawCards(rng, 2 * n).reshape(2, n)
+    playerTotal = cards[0] + cards[1]
+    playerAce = (cards[0] == 1) | (cards[1] == 1)
+    dealerCard = drawCards(rng, n)
+
+    rewards = np.empty(n)
+    busted = np.zeros(n, dtype=bool)
+    active = np.arange(n)
+    while active.size:
+        total = playerTotal[active]
+        useable = playerAce[active] & (total + 10 <= 21)
+        values = total + 10 * useable
+        state = ((dealerCard[active] - 1) * PLAYER_TOTALS + (values - 2)) * 2 + useable
+        flatVisits += np.bincount(state, minlength=flatVisits.size)
+        hit = flatPolicy[state]
+
+        # Player stands
+        stands = active[~hit]
+        if stands.size:
+            dealerValues = dealerPlayBatch(dealerCard[stands], dealerCard[stands] == 1, rng)
+            rewards[stands] = getRewardsByTotals(dealerValues, handTotals(playerTotal[stands], playerAce[stands]))
+
+        # Player hits
+        hits = active[hit]
+        if hits.size:
+            newCards = drawCards(rng, hits.size)
+            playerTotal[hits] += newCards
+            playerAce[hits] |= (newCards == 1)
+            bust = handTotals(playerTotal[hits], playerAce[hits]) > 21
+            rewards[hits[bust]] = -1.0
+            busted[hits[bust]] = True
+            hits = hits[~bust]
+        active = hits
+
+    return rewards, busted
+
+def evaluatePolicy(policySet, hands=1000000, targetHalfWidth=None, confidence=0.95, seed=None,
+                   batchSize=BATCH_SIZE):
+    """ Plays up to hands hands of policySet and returns an EvaluationResult.
+
+    If targetHalfWidth is given, it stops as soon as the confidence interval of the mean gain is
+    narrower than +/- targetHalfWidth. """
+
+    rng = np.random.default_rng(seed)
+    policy = policyArray(policySet)
+    z = Z_SCORES[confidence]
+    visits = np.zeros(policy.shape, dtype=np.int64)
+
+    played = 0
+    gain = 0.0
+    wins = pushes = losses = busts = 0
+    while played < hands:
+        n = min(batchSize, hands - played)
+        rewards, busted = playBatch(policy, n, rng, visits)
+        played += n
+        gain += rewards.sum()
+        wins += int(np.count_nonzero(rewards > 0))
+        pushes += int(np.count_nonzero(rewards == 0))
+        busts += int(np.count_nonzero(busted))
+        losses += int(np.count_nonzero(rewards < 0)) - int(np.count_nonzero(busted))
+
+        if targetHalfWidth is not None and played > 1:
+            mean = gain / played
+            # rewards are -1, 0 or 1, so the sum of squares is the number of wins and losses
+            variance = ((wins + losses + busts) / played - mean * mean) * played / (played - 1)
+            if z * (variance / played) ** 0.5 <= targetHalfWidth:
+                break
+
+    mean = gain / played
+    variance = ((wins + losses + busts) / played - mean * mean) * played / max(played - 1, 1)
+    standardError = (variance / played) ** 0.5
+    return EvaluationResult(played, mean, standardError, (mean - z * standardError, mean + z * standardError),
+                            wins / played, pushes / played, losses / played, busts / played, visits)
+
+def printEvaluation(result):
+    low, high = result.confidenceInterval
+    print('AverageGain: %6.3f +/- %.3f [%6.3f, %6.3f] over %d hands' % (result.meanGain, result.standardError,
+                                                                       low, high, result.hands))
+    print('win %.3f push %.3f loss %.3f bust %.3f' % (result.winRate, result.pushRate, result.lossRate,
+                                                       result.bustRate))
@@ -0,0 +1,272 @@
+from array import array
+import random
+from ai import dealDealer, addCardToHand, drawCard, dealerPlay, getHandTotal, handHasUseableAce, getRewardByHands
+
+"""
+Q learning with every action of the table: stand, hit, double, split and surrender.
+
+ai.q_learning only learns whether to hit, with True/False as the action. Here
+the actions are the ints STAND, HIT, DOUBLE, SPLIT and SURRENDER, and the state
+is (dealerCard, playerTotal, hasUseableAce, kind) where kind tells which
+actions the hand can take:
+
+    AFTER_HIT     the hand has been hit: stand or hit
+    FIRST         the first two cards: stand, hit, double or surrender
+    AFTER_SPLIT   one of the two hands of a split, with its second card: stand, hit or double
+    PAIR + card   the first two cards are a pair of card (1 to 10): all five actions
+
+Surrender gives back half the bet (-0.5), double takes exactly one card for
+twice the reward and split plays the two cards as two new hands of one card
+each, which can not be split again. Split and surrender can be turned off.
+
+The Q values and counters are flat arrays of doubles, like the buckets of
+counting.py, indexed by stateIndex(kind, dealerCard, playerTotal, hasUseableAce)
+plus the action.
+"""
+
+STAND = 0
+HIT = 1
+DOUBLE = 2
+SPLIT = 3
+SURRENDER = 4
+ACTION_NAMES = ['stand', 'hit', 'double', 'split', 'surrender']
+ACTIONS = len(ACTION_NAMES)
+
+AFTER_HIT = 0
+FIRST = 1
+AFTER_SPLIT = 2
+# a pair of card is the kind PAIR + card, 3 to 12
+PAIR = AFTER_SPLIT
+KINDS = PAIR + 11
+
+DEALER_CARDS = 10
+PLAYER_TOTALS = 20
+TABLE_SIZE = KINDS * DEALER_CARDS * PLAYER_TOTALS * 2 * ACTIONS
+
+def getLegalActions(kind, allowSplit=True, allowSurrender=True):
+    """ Actions the hand can take, stand first so that ties go to stand like ai.getBestActionByQ. """
+
+    if kind == AFTER_HIT:
+        return (STAND, HIT)
+    actions = [STAND, HIT, DOUBLE]
+    if kind > PAIR and allowSplit:
+        actions.append(SPLIT)
+    if kind != AFTER_SPLIT and allowSurrender:
+        actions.append(SURRENDER)
+    return tuple(actions)
+
+def stateIndex(kind, dealerCard, playerTotal, hasUseableAce):
+    """ Index of the STAND value of the state in the table, the other actions follow it. """
+
+    return (((kind * DEALER_CARDS + dealerCard - 1) * PLAYER_TOTALS + playerTotal - 2) * 2 + hasUseableAce) * ACTIONS
+
+def handIndex(kind, dealerCard, hand):
+    return stateIndex(kind, dealerCard, getHandTotal(hand), handHasUseableAce(hand))
+
+class FullQTable():
+    """ The Q values and visit counters of every (state, action), as flat arrays of doubles. """
+
+    def __init__(self, allowSplit=True, allowSurrender=True):
+        self.allowSplit = allowSplit
+        self.allowSurrender = allowSurrender
+        self.legal = [getLegalActions(kind, allowSplit, allowSurrender) for kind in range(0, KINDS)]
+        self.values = array('d', bytes(8 * TABLE_SIZE))
+        self.counters = array('d', bytes(8 * TABLE_SIZE))
+        # same initial values as ai.initializeQMap, hitting is better than standing under 10
+        for kind in range(0, KINDS):
+            for dealerCard in range(1, DEALER_CARDS + 1):
+                for playerTotal in range(2, 10):
+                    for hasUseableAce in (0, 1):
+                        index = stateIndex(kind, dealerCard, playerTotal, hasUseableAce)
+                        self.values[index + STAND] = -0.1
+                        self.values[index + HIT] = 0.1
+
+    def actionValues(self, kind, dealerCard, playerTotal, hasUseableAce):
+        """ Dict of the Q value of every legal action of the state. """
+
+        index = stateIndex(kind, dealerCard, playerTotal, hasUseableAce)
+        return dict((action, self.values[index + action]) for action in self.legal[kind])
+
+    def bestAction(self, kind, dealerCard, playerTotal, hasUseableAce, allowed=None):
+        """ The legal action with the highest Q value, only among allowed if it is given. """
+
+        index = stateIndex(kind, dealerCard, playerTotal, hasUseableAce)
+        best = None
+        for action in self.legal[kind]:
+            if allowed is not None and action not in allowed:
+                continue
+            if best is None or self.values[index + action] > self.values[index + best]:
+                best = action
+        return best
+
+def getKind(card1, card2, allowSplit=True):
+    if card1 == card2 and allowSplit:
+        return PAIR + card1
+    return FIRST
+
+# Q learning.
+def q_learning_full(learningTimes, alpha, discount, epsilon, allowSplit=True, allowSurrender=True, shoe=None,
+                    table=None):
+    """ Same update rule as ai.q_learning, over every action. Every episode deals a real first hand, so pairs
+    come up as often as at the table. Split bootstraps from the best values of both new hands and goes on
+    playing the first one. Returns the FullQTable. """
+
+    if table is None:
+        table = FullQTable(allowSplit, allowSurrender)
+    values = table.values
+    counters = table.counters
+    legal = table.legal
+    rand = random.random if shoe is None else shoe.random.random
+    for n in range(0, learningTimes):
+        if shoe is not None:
+            shoe.startRound()
+        card1 = drawCard(shoe)
+        card2 = drawCard(shoe)
+        playerHand = addCardToHand(card2, addCardToHand(card1, (0, False)))
+        dealerCard, dealerHand = dealDealer(shoe)
+        kind = getKind(card1, card2, allowSplit)
+        index = handIndex(kind, dealerCard, playerHand)
+        while True:
+            actions = legal[kind]
+            # epsilon greedy, ties go to the first legal action (stand)
+            if rand() < epsilon:
+                action = actions[int(rand() * len(actions))]
+            else:
+                action = actions[0]
+                for other in actions:
+                    if values[index + other] > values[index + action]:
+                        action = other
+            pair = index + action
+            counters[pair] += 1.0
+
+            if action == HIT:
+                playerHand = addCardToHand(drawCard(shoe), playerHand)
+                # Player does not bust
+                if getHandTotal(playerHand) <= 21:
+                    nextIndex = handIndex(AFTER_HIT, dealerCard, playerHand)
+                    maxQ = max(values[nextIndex + STAND], values[nextIndex + HIT])
+                    values[pair] += alpha / counters[pair] * (discount * maxQ - values[pair])
+                    kind = AFTER_HIT
+                    index = nextIndex
+                    continue
+                target = -1.0
+            elif action == STAND:
+                target = getRewardByHands(dealerPlay(dealerHand, shoe), playerHand)
+            elif action == DOUBLE:
+                playerHand = addCardToHand(drawCard(shoe), playerHand)
+                if getHandTotal(playerHand) <= 21:
+                    target = 2.0 * getRewardByHands(dealerPlay(dealerHand, shoe), playerHand)
+                else:
+                    target = -2.0
+            elif action == SURRENDER:
+                target = -0.5
+            else:
+                # SPLIT: both hands get a second card, the value is the sum of their best values
+                splitHand = addCardToHand(card1, (0, False))
+                firstHand = addCardToHand(drawCard(shoe), splitHand)
+                secondHand = addCardToHand(drawCard(shoe), splitHand)
+                maxQ = 0.0
+                for hand in (firstHand, secondHand):
+                    handStart = handIndex(AFTER_SPLIT, dealerCard, hand)
+                    maxQ += max(values[handStart + other] for other in legal[AFTER_SPLIT])
+                values[pair] += alpha / counters[pair] * (discount * maxQ - values[pair])
+                playerHand = firstHand
+                kind = AFTER_SPLIT
+                index = handIndex(AFTER_SPLIT, dealerCard, firstHand)
+                continue
+            values[pair] += alpha / counters[pair] * (target - values[pair])
+            break
+    return table
+
+def fullPolicyHelper(table, allowed=None):
+    """ The best action of every state, as a dict mapping (dealerCard, playerTotal, hasUseableAce, kind) to an
+    action, only among allowed if it is given (e.g. (STAND, HIT, DOUBLE) for the game, which can't split). """
+
+    policy = {}
+    for kind in range(0, KINDS):
+        for dealerCard in range(1, DEALER_CARDS + 1):
+            for playerTotal in range(2, 22):
+                for hasUseableAce in (True, False):
+                    policy[(dealerCard, playerTotal, hasUseableAce, kind)] = \
+                        table.bestAction(kind, dealerCard, playerTotal, hasUseableAce, allowed)
+    return policy
+
+def cachedFullQTable(params, train):
+    """ Returns the FullQTable for params from policycache, or calls train() to get it and caches its values. The
+    key covers fullq.py as well as the rule files of the hit/stand learning. """
+
+    from policycache import RULE_FILES, loadArray, saveArray
+    files = RULE_FILES + ['fullq.py']
+    values = loadArray(params, (TABLE_SIZE,), 'fullq', files)
+    if values is not None:
+        table = FullQTable(params['split'], params['surrender'])
+        table.values = array('d', values.tobytes())
+        return table
+    table = train()
+    saveArray(params, table.values, 'fullq', files)
+    return table
+
+def getFullPolicySet(n_iter_q=3500000, alpha=1, discount=1, epsilon=0.1, allowed=None, useCache=True,
+                     progress=None, checkpointTimes=100000):
+    # progress is called with (episodes, maxEpisodes) every checkpointTimes episodes while training
+    params = {'n_iter': n_iter_q, 'alpha': alpha, 'epsilon': epsilon, 'discount': discount, 'split': True,
+              'surrender': True}
+
+    def train():
+        print('Q-LEARNING -- ALL ACTIONS')
+        # learning in chunks on the same table learns exactly what a single run would
+        table = FullQTable()
+        for done in range(0, n_iter_q, checkpointTimes):
+            q_learning_full(min(checkpointTimes, n_iter_q - done), alpha, discount, epsilon, table=table)
+            if progress is not None:
+                progress(min(done + checkpointTimes, n_iter_q), n_iter_q)
+        return table
+
+    table = cachedFullQTable(params, train) if useCache else train()
+    return fullPolicyHelper(table, allowed)
+
+def print_full_policy(table):
+    """ Prints the first decision of every hard total, soft total and pair, with one letter per action. """
+
+    letters = 'SHDPR'
+    for title, kind, hasUseableAce, rows in [('Hard totals', FIRST, False, range(20, 4, -1)),
+                                             ('Soft totals', FIRST, True, range(20, 12, -1)),
+                                             ('Pairs', None, None, range(10, 0, -1))]:
+        print(title)
+        for row in rows:
+            for dealerCard in range(1, DEALER_CARDS + 1):
+                if kind is None:
+                    action = table.bestAction(PAIR + row, dealerCard, 12 if row == 1 else 2 * row, row == 1)
+                else:
+                    action = table.bestAction(kind, dealerCard, row, hasUseableAce)
+                print(letters[action], end=' ')
+            print('| %d' % row)
+        print(' ')
+
+def test():
+    """ Learns the full policy and checks a few textbook decisions, then compares the speed with ai.q_learning. """
+
+    import time
+    from ai import q_learning
+    random.seed(1)
+    n_times = 2000000
+    start = time.perf_counter()
+    table = q_learning_full(n_times, 1, 1, 0.1)
+    fullSeconds = time.perf_counter() - start
+    print_full_policy(table)
+
+    # double 11 against a 6, split aces and eights against a 6, stand on hard 20, hit hard 5
+    assert table.bestAction(FIRST, 6, 11, False) == DOUBLE
+    assert table.bestAction(PAIR + 1, 6, 12, True) == SPLIT
+    assert table.bestAction(PAIR + 8, 6, 16, False) == SPLIT
+    assert table.bestAction(FIRST, 5, 20, False) == STAND
+    assert table.bestAction(FIRST, 10, 5, False) == HIT
+
+    start = time.perf_counter()
+    q_learning(n_times // 10, 1, 1, 0.1)
+    twoActionSeconds = (time.perf_counter() - start) * 10
+    print('%.0f episodes/s with every action, %.0f with hit/stand' % (n_times / fullSeconds,
+                                                                      n_times / twoActionSeconds))
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,100 @@
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+from vectorq import qArrayToMap, qMapToArray, STATE_SHAPE
+
+"""
+On disk cache for the learned Q values, so the game does not have to train again at every launch.
+
+The Q values are saved as a plain .npy array of STATE_SHAPE (see vectorq.py) that is memory-mapped when
+it is loaded. The file name is q-v<version>-<params key>-<source key>.npy: the params key is built from the
+training parameters and the cache version, the source key from the files that define the rules and the
+learning (RULE_FILES), so changing any of them makes the game train again instead of loading a stale policy.
+
+Every set of parameters keeps its own file, so training with other parameters (another engine, a shoe) does
+not evict it. Saving only removes the files the new one replaces: the same params key with an older source
+key, and the files of older cache versions. loadArray and saveArray cache other arrays the same way under
+another name, like the Q table of fullq.py.
+"""
+
+CACHE_VERSION = 2
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+RULE_FILES = ['ai.py', 'vectorq.py', 'solver.py', 'shoe.py', 'dealertable.py', 'counting.py']
+
+def sourceDigest(files=RULE_FILES):
+    """ Hash of the files that define the game rules and the learning algorithm. """
+
+    digest = hashlib.sha1()
+    moduleDir = os.path.dirname(os.path.abspath(__file__))
+    for name in files:
+        with open(os.path.join(moduleDir, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def paramsKey(params):
+    """ params is a dict of the training parameters, e.g. n_iter, alpha, epsilon, discount and deck. """
+
+    content = json.dumps({'version': CACHE_VERSION, 'params': params}, sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+
+def cachePath(params, name='q', files=RULE_FILES):
+    """ name tells the kind of array apart (q for the Q arrays), files are the sources it depends on. """
+
+    return os.path.join(CACHE_DIR, '%s-v%d-%s-%s.npy' % (name, CACHE_VERSION, paramsKey(params),
+                                                         sourceDigest(files)[:16]))
+
+def staleFiles(params, name='q', files=RULE_FILES):
+    """ The cache files that the file of params replaces, they can never be loaded again. """
+
+    path = cachePath(params, name, files)
+    stale = glob.glob(os.path.join(CACHE_DIR, '%s-v%d-%s-*.npy' % (name, CACHE_VERSION, paramsKey(params))))
+    for old in glob.glob(os.path.join(CACHE_DIR, '%s-v*.npy' % name)):
+        if not os.path.basename(old).startswith('%s-v%d-' % (name, CACHE_VERSION)):
+            stale.append(old)
+    return [old for old in stale if old != path]
+
+def loadArray(params, shape, name='q', files=RULE_FILES):
+    """ Returns the cached array for params (memory-mapped, read only), or None if there is none. """
+
+    path = cachePath(params, name, files)
+    if not os.path.exists(path):
+        return None
+    try:
+        values = np.load(path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    if values.shape != shape:
+        return None
+    return values
+
+def saveArray(params, values, name='q', files=RULE_FILES):
+    """ Saves values for params and removes the files it replaces, see staleFiles. """
+
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    path = cachePath(params, name, files)
+    for old in staleFiles(params, name, files):
+        os.remove(old)
+    # write to a temporary file first so a crash never leaves a half written cache behind
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'wb') as f:
+        np.save(f, np.asarray(values, dtype=np.float64))
+    os.replace(tmpPath, path)
+
+def loadQArray(params):
+    return loadArray(params, STATE_SHAPE)
+
+def saveQArray(params, Q):
+    saveArray(params, Q)
+
+def cachedQMap(params, train):
+    """ Returns the qMap for params from the cache, or calls train() to get it and caches the result. """
+
+    Q = loadQArray(params)
+    if Q is not None:
+        return qArrayToMap(Q)
+    qMap = train()
+    saveQArray(params, qMapToArray(qMap))
+    return qMap
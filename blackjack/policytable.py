@@ -0,0 +1,136 @@
+"""
+A policySet of ai.policyHelper packed into bits.
+
+A policySet is two dicts keyed by (dealerCard, playerTotal) tuples, one for
+the hands with a useable ace and one for the others, with True for hit. There
+are only 10 dealer cards, 20 player totals (2 to 21) and 2 ace flags, so a
+PolicyTable keeps the whole policy in 400 bits: bit
+stateIndex(dealerCard, playerTotal, hasUseableAce) of a 50 byte bytearray, in
+the same order as the states of vectorq.py and evaluate.py.
+
+serialize() is MAGIC followed by those 50 bytes, 54 bytes in all, and
+loadPolicyTable reads it back. hits() looks up whole numpy arrays of states
+at once, for the simulators.
+"""
+
+MAGIC = b'BJP1'
+DEALER_CARDS = 10
+PLAYER_TOTALS = 20
+N_STATES = DEALER_CARDS * PLAYER_TOTALS * 2
+N_BYTES = (N_STATES + 7) // 8
+
+def stateIndex(dealerCard, playerTotal, hasUseableAce):
+    """ Bit of the state in the table, works on numpy arrays too. """
+
+    return ((dealerCard - 1) * PLAYER_TOTALS + (playerTotal - 2)) * 2 + hasUseableAce
+
+class PolicyTable():
+    """ Hit (True) or stand (False) for every state, one bit each. """
+
+    def __init__(self, bits=None):
+        self.bits = bytearray(N_BYTES) if bits is None else bytearray(bits)
+        # the bits unpacked into a numpy array of bools, made by toArray the first time hits needs it
+        self.unpacked = None
+
+    def __eq__(self, other):
+        return isinstance(other, PolicyTable) and self.bits == other.bits
+
+    def hit(self, dealerCard, playerTotal, hasUseableAce):
+        index = stateIndex(dealerCard, playerTotal, hasUseableAce)
+        return bool(self.bits[index >> 3] >> (index & 7) & 1)
+
+    def setHit(self, dealerCard, playerTotal, hasUseableAce, hit):
+        index = stateIndex(dealerCard, playerTotal, hasUseableAce)
+        if hit:
+            self.bits[index >> 3] |= 1 << (index & 7)
+        else:
+            self.bits[index >> 3] &= ~(1 << (index & 7))
+        self.unpacked = None
+
+    def toPolicySet(self):
+        """ The policySet of ai.policyHelper back, e.g. for print_policy. """
+
+        policySet = [{}, {}]
+        for playerTotal in range(21, 1, -1):
+            for dealerCard in range(1, DEALER_CARDS + 1):
+                policySet[0][(dealerCard, playerTotal)] = self.hit(dealerCard, playerTotal, True)
+                policySet[1][(dealerCard, playerTotal)] = self.hit(dealerCard, playerTotal, False)
+        return policySet
+
+    def toArray(self):
+        """ The policy as a numpy array of bools indexed by [dealerCard - 1, playerTotal - 2, hasUseableAce]. """
+
+        if self.unpacked is None:
+            import numpy as np
+            bits = np.unpackbits(np.frombuffer(bytes(self.bits), dtype=np.uint8), bitorder='little')
+            self.unpacked = bits[:N_STATES].astype(bool).reshape(DEALER_CARDS, PLAYER_TOTALS, 2)
+        return self.unpacked
+
+    def hits(self, dealerCards, playerTotals, hasUseableAces):
+        """ hit() of every state of the three arrays at once, returns an array of bools. """
+
+        return self.toArray().reshape(-1)[stateIndex(dealerCards, playerTotals, hasUseableAces)]
+
+    def serialize(self):
+        return MAGIC + bytes(self.bits)
+
+def packPolicySet(policySet):
+    """ Packs the policySet of ai.policyHelper into a PolicyTable. """
+
+    table = PolicyTable()
+    for hasUseableAce, policy in [(True, policySet[0]), (False, policySet[1])]:
+        for (dealerCard, playerTotal), hit in policy.items():
+            table.setHit(dealerCard, playerTotal, hasUseableAce, hit)
+    return table
+
+def loadPolicyTable(data):
+    """ The PolicyTable of serialize(). Raises ValueError if data is not one. """
+
+    if len(data) != len(MAGIC) + N_BYTES or data[:len(MAGIC)] != MAGIC:
+        raise ValueError('not a serialized PolicyTable')
+    return PolicyTable(data[len(MAGIC):])
+
+def test():
+    """ Packs the exact policy and checks every lookup against the dicts, the round trip through serialize and the
+    batch lookup, then compares the speed of a lookup with the dicts. """
+
+    import time
+    import numpy as np
+    from ai import policyHelper
+    from solver import solveQMap
+    policySet = policyHelper(solveQMap())
+    table = packPolicySet(policySet)
+
+    for hasUseableAce, policy in [(True, policySet[0]), (False, policySet[1])]:
+        for (dealerCard, playerTotal), hit in policy.items():
+            assert table.hit(dealerCard, playerTotal, hasUseableAce) == hit
+    assert table.toPolicySet() == policySet
+    data = table.serialize()
+    assert loadPolicyTable(data) == table
+    print('serialized in %d bytes' % len(data))
+
+    rng = np.random.default_rng(1)
+    dealerCards = rng.integers(1, DEALER_CARDS + 1, 100000)
+    playerTotals = rng.integers(2, 22, 100000)
+    aces = rng.integers(0, 2, 100000).astype(bool)
+    batch = table.hits(dealerCards, playerTotals, aces)
+    for n in range(0, 1000):
+        assert batch[n] == policySet[0 if aces[n] else 1][(dealerCards[n], playerTotals[n])]
+
+    states = list(zip(dealerCards.tolist(), playerTotals.tolist(), aces.tolist()))
+    start = time.perf_counter()
+    for dealerCard, playerTotal, hasUseableAce in states:
+        policySet[0 if hasUseableAce else 1][(dealerCard, playerTotal)]
+    dictSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for dealerCard, playerTotal, hasUseableAce in states:
+        table.hit(dealerCard, playerTotal, hasUseableAce)
+    tableSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    table.hits(dealerCards, playerTotals, aces)
+    batchSeconds = time.perf_counter() - start
+    print('lookups/s: %.0f dicts, %.0f table, %.0f batch' % (len(states) / dictSeconds, len(states) / tableSeconds,
+                                                               len(states) / batchSeconds))
+
+if __name__ == '__main__':
+    test()
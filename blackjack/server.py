@@ -0,0 +1,318 @@
+import argparse
+import asyncio
+import collections
+import json
+import random
+import sys
+import time
+from engine import Game
+from utils import cardName
+
+"""
+Headless multi-table server, to use the game as a load generator and strategy testbed.
+
+Every table is an engine.Game with its own deck, funds and bet, and
+all of them live in one asyncio event loop. Players connect over a local socket
+(TCP on 127.0.0.1, or a unix socket with --unix) and send one request per line:
+
+    <table> <command>
+
+where table is any name the player picks and command is one of:
+
+    open      sit at the table, starting a new game (also restarts a finished one)
+    deal      deal a new round
+    hit       take a card
+    stand     let the dealer play and compare the hands
+    double    double the bet, take one card and stand
+    up, down  raise or lower the bet by 5 in between rounds
+    state     just return the state
+    close     leave the table
+
+Every request gets one JSON line back, in order, with the state of the table
+(the dealer's hole card is None while the round is being played) or an error.
+A connection can play as many tables as it likes and pipeline its requests.
+
+The server prints the rounds played per second and the 99th percentile of the
+time spent on an action every --report seconds. `python server.py load` runs
+the server and a set of simple bots against it in the same process and prints
+the same numbers as seen by the bots:
+
+    python server.py serve --port 8765
+    python server.py load --tables 2000 --connections 20 --seconds 10
+"""
+
+DEFAULT_PORT = 8765
+REPORT_SECONDS = 5.0
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+class Stats():
+    """ Rounds played and action latencies since the last report. """
+
+    def __init__(self):
+        self.rounds = 0
+        self.actions = 0
+        self.latencies = []
+        self.start = time.perf_counter()
+
+    def add(self, seconds, roundsEnded):
+        self.actions += 1
+        self.rounds += roundsEnded
+        self.latencies.append(seconds)
+
+    def report(self):
+        """ Returns (rounds per second, actions per second, p99 latency in seconds) and starts over. """
+
+        now = time.perf_counter()
+        elapsed = max(now - self.start, 1e-9)
+        result = (self.rounds / elapsed, self.actions / elapsed, percentile(self.latencies, 0.99))
+        self.rounds = 0
+        self.actions = 0
+        self.latencies = []
+        self.start = now
+        return result
+
+def tableState(name, game):
+    playerHand = game.playerHand if game.roundEnd == 0 else game.lastPlayerHand
+    dealerHand = game.dealerHand[0:1] if game.roundEnd == 0 else game.lastDealerHand
+    dealerNames = [cardName(card) for card in dealerHand]
+    if game.roundEnd == 0:
+        dealerNames.append(None)
+    return {
+        'table': name,
+        'funds': game.funds,
+        'bet': game.bet,
+        'player': [cardName(card) for card in playerHand],
+        'dealer': dealerNames,
+        'playerValue': playerHand.value()[0],
+        'roundEnd': game.roundEnd,
+        'handsPlayed': game.handsPlayed,
+        'message': game.message,
+        'gain': game.lastGain,
+        'gameOver': game.gameOver,
+    }
+
+ACTIONS = {
+    'deal': Game.deal,
+    'hit': Game.hit,
+    'stand': Game.stand,
+    'double': Game.double,
+    'up': Game.betUp,
+    'down': Game.betDown,
+    'state': lambda game: None,
+}
+
+class TableServer():
+    """ With a seed, every table opened gets its own deck generator, seeded from a generator seeded with seed, so
+    the same requests in the same order give the same games. """
+
+    def __init__(self, report=REPORT_SECONDS, seed=None):
+        self.tables = {}
+        self.seeds = random.Random(seed) if seed is not None else None
+        self.clients = set()
+        self.stats = Stats()
+        self.reportSeconds = report
+
+    def handle(self, line):
+        """ Plays one request line (bytes) and returns the reply and the number of rounds it ended (0 or 1). """
+
+        try:
+            parts = line.decode().split()
+        except UnicodeDecodeError:
+            return {'error': 'the request is not utf-8'}, 0
+        if len(parts) != 2:
+            return {'error': 'expected "<table> <command>"'}, 0
+        name, command = parts
+
+        if command == 'open':
+            self.tables[name] = Game(seed=self.seeds.getrandbits(64) if self.seeds else None)
+            return tableState(name, self.tables[name]), 0
+        game = self.tables.get(name)
+        if game is None:
+            return {'table': name, 'error': 'no such table, open it first'}, 0
+        if command == 'close':
+            del self.tables[name]
+            return {'table': name, 'closed': True}, 0
+        action = ACTIONS.get(command)
+        if action is None:
+            return {'table': name, 'error': 'unknown command %r' % command}, 0
+        if game.gameOver:
+            return dict(tableState(name, game), error='game over, open the table again'), 0
+
+        # a round ends on the action that finishes it, or on the deal itself when a natural is dealt
+        inRound = game.roundEnd == 0
+        handsPlayed = game.handsPlayed
+        action(game)
+        roundEnded = game.roundEnd == 1 and (inRound or game.handsPlayed != handsPlayed)
+        return tableState(name, game), int(roundEnded)
+
+    async def serveClient(self, reader, writer):
+        task = asyncio.current_task()
+        self.clients.add(task)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                start = time.perf_counter()
+                reply, roundsEnded = self.handle(line)
+                writer.write(json.dumps(reply).encode() + b'\n')
+                self.stats.add(time.perf_counter() - start, roundsEnded)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(task)
+            writer.close()
+
+    async def reportLoop(self):
+        while True:
+            await asyncio.sleep(self.reportSeconds)
+            roundsPerSecond, actionsPerSecond, p99 = self.stats.report()
+            print('server: %d tables, %.0f rounds/s, %.0f actions/s, p99 action %.3f ms'
+                  % (len(self.tables), roundsPerSecond, actionsPerSecond, p99 * 1000))
+
+    async def start(self, host='127.0.0.1', port=DEFAULT_PORT, unix=None):
+        if unix:
+            server = await asyncio.start_unix_server(self.serveClient, unix)
+        else:
+            server = await asyncio.start_server(self.serveClient, host, port)
+        self.reporter = asyncio.ensure_future(self.reportLoop())
+        self.server = server
+        return server
+
+    async def stop(self):
+        """ Stops listening and waits for the connected players to leave. """
+
+        self.reporter.cancel()
+        self.server.close()
+        await self.server.wait_closed()
+        if self.clients:
+            await asyncio.wait(list(self.clients))
+
+class Connection():
+    """ Client side of one connection. Requests are answered in order, so the replies are matched to a queue of
+    futures and many tables can share the connection. """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.waiting = collections.deque()
+        self.readerTask = asyncio.ensure_future(self.readReplies())
+
+    async def readReplies(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            self.waiting.popleft().set_result(json.loads(line))
+
+    async def request(self, table, command):
+        future = asyncio.get_event_loop().create_future()
+        self.waiting.append(future)
+        self.writer.write(('%s %s\n' % (table, command)).encode())
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        await self.readerTask
+
+async def playTable(connection, name, stopAt, latencies, counts):
+    """ A bot that plays one table until stopAt: it hits below 17, stands otherwise and reopens the table when
+    the game is over. """
+
+    async def request(command):
+        start = time.perf_counter()
+        reply = await connection.request(name, command)
+        latencies.append(time.perf_counter() - start)
+        return reply
+
+    state = await request('open')
+    while time.perf_counter() < stopAt:
+        if state['gameOver']:
+            state = await request('open')
+        state = await request('deal')
+        while state['roundEnd'] == 0:
+            state = await request('hit' if state['playerValue'] < 17 else 'stand')
+        counts[0] += 1
+    await request('close')
+
+async def runLoad(tables, connections, seconds, host='127.0.0.1', port=DEFAULT_PORT, unix=None):
+    """ Plays tables tables over connections connections for seconds seconds, returns (rounds per second,
+    p99 round trip latency in seconds). """
+
+    opened = []
+    for n in range(0, connections):
+        if unix:
+            reader, writer = await asyncio.open_unix_connection(unix)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        opened.append(Connection(reader, writer))
+
+    latencies = []
+    counts = [0]
+    start = time.perf_counter()
+    await asyncio.gather(*[playTable(opened[n % connections], 'table%d' % n, start + seconds, latencies, counts)
+                           for n in range(0, tables)])
+    elapsed = time.perf_counter() - start
+    for connection in opened:
+        await connection.close()
+    return counts[0] / elapsed, percentile(latencies, 0.99)
+
+async def serve(args):
+    server = await TableServer(args.report, args.seed).start(args.host, args.port, args.unix)
+    print('serving on %s' % (args.unix or '%s:%d' % (args.host, args.port)))
+    async with server:
+        await server.serve_forever()
+
+async def load(args):
+    tableServer = TableServer(args.report, args.seed)
+    await tableServer.start(args.host, args.port, args.unix)
+    roundsPerSecond, p99 = await runLoad(args.tables, args.connections, args.seconds, args.host, args.port,
+                                         args.unix)
+    await tableServer.stop()
+    print('load: %d tables, %.0f rounds/s, p99 round trip %.3f ms' % (args.tables, roundsPerSecond, p99 * 1000))
+    return roundsPerSecond, p99
+
+def test():
+    """ Checks that the bet buttons of a table work with the fractional funds and bets a 3:2 payout leaves, through
+    TableServer.handle like a player would send them. """
+
+    tableServer = TableServer(seed=1)
+    tableServer.handle(b't open')
+    game = tableServer.tables['t']
+    for funds, bet, command, expected in [(102.5, 97.5, b't up', 100.0), (102.5, 97.5, b't down', 95.0),
+                                          (7.5, 7.5, b't down', 5.0), (107.5, 102.5, b't up', 105.0),
+                                          (100.0, 10.0, b't up', 15.0), (100.0, 10.0, b't down', 5.0)]:
+        game.funds, game.bet = funds, bet
+        reply, roundsEnded = tableServer.handle(command)
+        assert reply['bet'] == expected, (funds, bet, command, reply)
+        assert roundsEnded == 0
+    print('bets with fractional funds are ok')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless multi-table blackjack server.')
+    parser.add_argument('mode', choices=['serve', 'load'], help='serve forever, or run bots against a server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', help='listen on this unix socket path instead of TCP')
+    parser.add_argument('--report', type=float, default=REPORT_SECONDS, help='seconds between server reports')
+    parser.add_argument('--tables', type=int, default=1000, help='tables played by the load bots')
+    parser.add_argument('--connections', type=int, default=10, help='connections the load bots share')
+    parser.add_argument('--seconds', type=float, default=10.0, help='how long the load bots play')
+    parser.add_argument('--seed', type=int, help='seed of the shuffles')
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args) if args.mode == 'serve' else load(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,36 +1,217 @@
+import collections
 import os
 import pygame
 from pygame.locals import *
 
-def imageLoad(name, card):
-    """ Function for loading an image. Makes sure the game is compatible across multiple OS'es, as it
-    uses the os.path.join function to get he full filename. It then tries to load the image, and raises
-    an exception if it can't, so the user will know specifically what's going if the image loading does not work. """
+"""
+The pygame subsystems are started on first use, not on import: the display by getScreen, the mixer by
+getSoundBank and the fonts by getFont. Importing the game costs the pygame import only, and the rules and the ai
+(engine.py, ai.py) don't import pygame at all.
+"""
+
+SCREEN_SIZE = (820, 540)
+
+# Every image of images/ and images/cards/, keyed by (name, card), filled once by loadImages
+images = {}
+
+def getScreen():
+    """ Returns the window's surface, opening the window the first time. """
+
+    screen = pygame.display.get_surface()
+    if screen is None:
+        screen = pygame.display.set_mode(SCREEN_SIZE)
+    return screen
 
+def imageFile(name, card):
     if card == 1:
-        fullname = os.path.join("images/cards/", name)
+        return os.path.join("images/cards/", name)
     else:
-        fullname = os.path.join('images', name)
+        return os.path.join('images', name)
+
+def loadImages(atlas=False):
+    """ Loads every png under images/ and images/cards/ once, so imageLoad never has to touch the disk again.
+    With atlas, all the images are packed into one surface and each image is a subsurface of it. """
+
+    # convert needs the window
+    getScreen()
+    surfaces = {}
+    for card, folder in [(0, 'images'), (1, 'images/cards/')]:
+        for name in sorted(os.listdir(folder)):
+            if name.endswith('.png'):
+                surfaces[(name, card)] = pygame.image.load(imageFile(name, card)).convert()
+
+    if atlas:
+        surfaces = packAtlas(surfaces)
+
+    images.clear()
+    images.update(surfaces)
+
+def packAtlas(surfaces):
+    """ Packs the surfaces into rows of one atlas surface, tallest first, and returns the subsurfaces. """
 
-    image = pygame.image.load(fullname)
-    image = image.convert()
+    keys = sorted(surfaces, key=lambda key: surfaces[key].get_height(), reverse=True)
+    width = max(1024, max(surface.get_width() for surface in surfaces.values()))
+    positions = {}
+    x, y, rowHeight = 0, 0, 0
+    for key in keys:
+        w, h = surfaces[key].get_size()
+        if x + w > width:
+            x, y, rowHeight = 0, y + rowHeight, 0
+        positions[key] = pygame.Rect(x, y, w, h)
+        x += w
+        rowHeight = max(rowHeight, h)
+
+    atlasSurface = pygame.Surface((width, y + rowHeight)).convert()
+    for key, rect in positions.items():
+        atlasSurface.blit(surfaces[key], rect)
+    return dict((key, atlasSurface.subsurface(rect)) for key, rect in positions.items())
+
+def imageLoad(name, card):
+    """ Function for getting an image. The images are loaded from disk only once, by loadImages, with the
+    os.path.join function so the game is compatible across multiple OS'es. Every call returns the same shared
+    surface and a new rect, so the sprites can move their rect without affecting each other. """
+
+    if not images:
+        loadImages()
+
+    image = images[(name, card)]
 
     return image, image.get_rect()
 
+def changedRects(previous, current):
+    """ previous and current are the (key, surface, rect) lists of two frames, in drawing order. Returns the
+    rects of every item that was added, removed or moved, which are the regions that have to be redrawn. """
+
+    old = set((key, tuple(rect)) for key, surface, rect in previous)
+    new = set((key, tuple(rect)) for key, surface, rect in current)
+    return [pygame.Rect(rect) for key, rect in old ^ new]
+
+def drawRects(screen, drawList, rects):
+    """ Redraws only the given regions of the screen, blitting every item of drawList that touches them. """
+
+    for region in rects:
+        screen.set_clip(region)
+        for key, surface, rect in drawList:
+            if region.colliderect(rect):
+                screen.blit(surface, rect)
+    screen.set_clip(None)
+
 def soundLoad(name):
     """ Same idea as the imageLoad function. """
 
+    if not pygame.mixer.get_init():
+        pygame.mixer.init()
     fullName = os.path.join('sounds', name)
     sound = pygame.mixer.Sound(fullName)
 
     return sound
 
+# Reserved mixer channels the sound bank plays on
+SOUND_CHANNELS = 4
+
+class SoundBank():
+    """ Every sound of sounds/, decoded once, played on a fixed pool of reserved mixer channels. When every
+    channel is busy, the sound that started first is cut off for the new one, so bursts of clicks never pile up. """
+
+    def __init__(self, channels=SOUND_CHANNELS):
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        if pygame.mixer.get_num_channels() < channels:
+            pygame.mixer.set_num_channels(channels)
+        # Sound.play() on its own never picks a reserved channel
+        pygame.mixer.set_reserved(channels)
+        self.channels = [pygame.mixer.Channel(n) for n in range(0, channels)]
+        # order in which the channels started their sound, oldest first
+        self.order = collections.deque(range(0, channels))
+        self.sounds = {}
+        for name in sorted(os.listdir('sounds')):
+            if name.endswith('.wav') or name.endswith('.ogg'):
+                self.sounds[name] = soundLoad(name)
+        self.dropped = 0
+
+    def play(self, name):
+        for n in self.order:
+            if not self.channels[n].get_busy():
+                break
+        else:
+            # every channel is busy, drop the oldest sound
+            n = self.order[0]
+            self.dropped += 1
+        self.order.remove(n)
+        self.order.append(n)
+        self.channels[n].play(self.sounds[name])
+
+class NullSoundBank():
+    """ A sound bank that plays nothing, for headless runs or when there is no audio device. """
+
+    def __init__(self):
+        self.sounds = {}
+        self.dropped = 0
+
+    def play(self, name):
+        pass
+
+soundBank = None
+
+def getSoundBank():
+    """ Returns the sound bank, loading it the first time. Without a working audio device it is a NullSoundBank,
+    and setSoundBank(NullSoundBank()) silences the game. """
+
+    global soundBank
+    if soundBank is None:
+        try:
+            soundBank = SoundBank()
+        except pygame.error:
+            soundBank = NullSoundBank()
+    return soundBank
+
+def setSoundBank(bank):
+    global soundBank
+    soundBank = bank
+
+# Fonts by size, so the default font file is only opened once per size
+fonts = {}
+
+# Rendered text surfaces, least recently used first, and how often the cache was hit or missed
+TEXT_CACHE_SIZE = 256
+textCache = collections.OrderedDict()
+textCacheStats = {'hits': 0, 'misses': 0}
+
+def getFont(size):
+    """ Returns the shared default font of the given size. """
+
+    font = fonts.get(size)
+    if font is None:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        font = pygame.font.Font(None, size)
+        fonts[size] = font
+    return font
+
+def renderText(font, text, color=(255, 255, 255), background=(0, 0, 0)):
+    """ Same as pygame.font.Font.render(font, text, 1, color, background), but a text that was rendered
+    recently is returned from the cache instead of being rendered again. The surface is shared, don't draw
+    on it. """
+
+    key = (font, text, color, background)
+    surface = textCache.get(key)
+    if surface is not None:
+        textCacheStats['hits'] += 1
+        textCache.move_to_end(key)
+        return surface
+
+    textCacheStats['misses'] += 1
+    surface = pygame.font.Font.render(font, text, 1, color, background)
+    textCache[key] = surface
+    if len(textCache) > TEXT_CACHE_SIZE:
+        textCache.popitem(last=False)
+    return surface
+
 def display(font, sentence):
     """ Displays text at the bottom of the screen, informing the player of what is going on."""
 
-    displayFont = pygame.font.Font.render(font, sentence, 1, (255, 255, 255), (0, 0, 0))
+    displayFont = renderText(font, sentence)
     return displayFont
 
 def playClick():
-    clickSound = soundLoad("click2.wav")
-    clickSound.play()
\ No newline at end of file
+    getSoundBank().play("click2.wav")
\ No newline at end of file
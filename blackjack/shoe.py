@@ -0,0 +1,63 @@
+import random
+
+"""
+A finite shoe of N decks for ai.py, instead of the infinite deck of ai.drawCard.
+
+Only the number of cards left of each value matters to the ai, so the shoe is
+kept as an array of 10 counts (aces to tens, tens counting J, Q and K too).
+Drawing picks a random position among the remaining cards and walks the 10
+counts, so it costs the same no matter how big the shoe is.
+
+When the cards dealt reach the penetration (the cut card) the shoe is
+reshuffled at the start of the next round, like the game does with its dead deck.
+
+The shoe also keeps the Hi-Lo running count of the cards drawn since the last
+shuffle: 2 to 6 count +1, 7 to 9 count 0, tens and aces count -1.
+"""
+
+HI_LO = [0, -1, 1, 1, 1, 1, 1, 0, 0, 0, -1]
+
+class Shoe():
+    def __init__(self, decks=1, penetration=0.75, seed=None):
+        self.decks = decks
+        self.size = 52 * decks
+        self.cutCard = int(self.size * penetration)
+        self.random = random.Random(seed)
+        self.shuffle()
+
+    def shuffle(self):
+        """ Puts every card back in the shoe. """
+
+        self.counts = [4 * self.decks] * 9 + [16 * self.decks]
+        self.remaining = self.size
+        self.runningCount = 0
+
+    def draw(self):
+        """ Takes a random card out of the shoe and returns its value, 1 to 10 like ai.drawCard. """
+
+        if self.remaining == 0:
+            self.shuffle()
+        position = self.random.randrange(self.remaining)
+        counts = self.counts
+        card = 0
+        while position >= counts[card]:
+            position -= counts[card]
+            card += 1
+        counts[card] -= 1
+        self.remaining -= 1
+        self.runningCount += HI_LO[card + 1]
+        return card + 1
+
+    def trueCount(self):
+        """ Running count divided by the number of decks left in the shoe. """
+
+        return self.runningCount * 52.0 / max(self.remaining, 1)
+
+    def needsShuffle(self):
+        return self.size - self.remaining >= self.cutCard
+
+    def startRound(self):
+        """ Called before every round, reshuffles once the cut card has been reached. """
+
+        if self.needsShuffle():
+            self.shuffle()
@@ -0,0 +1,103 @@
+from ai import getAllPossibleStates, getHandsFromState, addCardToHand, getHandTotal, getNextState, print_policy
+
+"""
+Exact solver for the game that ai.q_learning samples.
+
+Instead of playing millions of episodes, it computes the probability of every
+final dealer total for each dealer hand (the dealer hits until 17 like
+ai.dealerPlay) and then runs value iteration over hit and stand. Cards come
+from the same infinite deck as ai.drawCard: 1 to 9 with probability 1/13 each
+and 10 with probability 4/13.
+
+The result is a qMap in the same format as ai.q_learning, so policyHelper and
+print_policy work on it directly.
+"""
+
+CARD_PROBABILITIES = [(card, 1.0 / 13) for card in range(1, 10)] + [(10, 4.0 / 13)]
+
+# Every dealer total over 21 counts the same in getRewardByHands, so all busts are stored as 22
+BUST = 22
+
+def dealerOutcomeDistribution(hand, memo=None):
+    """ Returns a dict mapping the dealer's final total (17 to 21, or BUST) to its probability, for a dealer
+    starting from hand and hitting until 17. """
+
+    if memo is None:
+        memo = {}
+    if hand in memo:
+        return memo[hand]
+
+    value = getHandTotal(hand)
+    if value > 21:
+        distribution = {BUST: 1.0}
+    elif value >= 17:
+        distribution = {value: 1.0}
+    else:
+        distribution = {}
+        for card, probability in CARD_PROBABILITIES:
+            for final, p in dealerOutcomeDistribution(addCardToHand(card, hand), memo).items():
+                distribution[final] = distribution.get(final, 0.0) + probability * p
+
+    memo[hand] = distribution
+    return distribution
+
+def getStandValue(playerValue, dealerDistribution):
+    """ Expected getRewardByHands for a player standing on playerValue. """
+
+    if playerValue > 21:
+        return -1.0
+    value = 0.0
+    for dealerValue, probability in dealerDistribution.items():
+        if dealerValue > 21 or playerValue > dealerValue:
+            value += probability
+        elif playerValue < dealerValue:
+            value -= probability
+    return value
+
+def solveQMap(discount=1, tolerance=1e-12):
+    """ Exact Q values of every state in getAllPossibleStates, keyed like the qMap of ai.q_learning. """
+
+    allStates = getAllPossibleStates()
+    memo = {}
+    qMap = {}
+
+    # standing does not depend on the other Q values, so it is computed once
+    for state in allStates:
+        dealerHand, playerHand = getHandsFromState(state)
+        qMap[(state, False)] = getStandValue(getHandTotal(playerHand), dealerOutcomeDistribution(dealerHand, memo))
+        qMap[(state, True)] = 0.0
+
+    # value iteration for hitting, player totals only grow so it settles after a few sweeps
+    while True:
+        maxDelta = 0.0
+        for state in allStates:
+            dealerHand, playerHand = getHandsFromState(state)
+            value = 0.0
+            for card, probability in CARD_PROBABILITIES:
+                nextHand = addCardToHand(card, playerHand)
+                if getHandTotal(nextHand) > 21:
+                    value -= probability
+                else:
+                    nextState = getNextState(state[0], nextHand)
+                    value += probability * discount * max(qMap[(nextState, True)], qMap[(nextState, False)])
+            maxDelta = max(maxDelta, abs(value - qMap[(state, True)]))
+            qMap[(state, True)] = value
+        if maxDelta <= tolerance:
+            break
+
+    return qMap
+
+def policyAgreement(policySet, exactPolicySet):
+    """ Share of the states (0 to 1) where policySet takes the same action as exactPolicySet, both policySets of
+    ai.policyHelper. """
+
+    same = 0
+    total = 0
+    for policy, exact in zip(policySet, exactPolicySet):
+        for item, action in exact.items():
+            same += policy[item] == action
+            total += 1
+    return same / total
+
+if __name__ == '__main__':
+    print_policy(solveQMap())
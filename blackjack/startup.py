@@ -0,0 +1,95 @@
+import os
+import subprocess
+import sys
+
+"""
+Startup time budget of the game and its tools.
+
+Every module is imported in a fresh interpreter (so nothing is cached in
+sys.modules, only the .pyc files are warm) and the import has to stay under
+its budget in IMPORT_BUDGETS. The rules and the ai must not import pygame, and
+importing the game must not open a window or start the mixer, see settings.py.
+
+FIRST_FRAME_BUDGET is the time from the start of the interpreter until the
+game has drawn its first frame, with SDL's dummy video and audio drivers so it
+runs without a display:
+
+    python startup.py
+"""
+
+# milliseconds, a few times what they take on a laptop so that only real regressions fail
+IMPORT_BUDGETS = {
+    'engine': 100,
+    'ai': 100,
+    'training': 200,
+    'server': 300,
+    'blackjack': 800,
+}
+FIRST_FRAME_BUDGET = 3000
+
+# modules that must import without pygame
+NO_PYGAME = ['engine', 'ai', 'utils', 'training', 'server', 'counting', 'bankroll']
+
+MEASURE_IMPORT = '''
+import sys, time
+start = time.perf_counter()
+import %s
+seconds = time.perf_counter() - start
+importedPygame = 'pygame' in sys.modules
+import pygame
+print(seconds, importedPygame, pygame.display.get_init(), bool(pygame.mixer.get_init()))
+'''
+
+MEASURE_FIRST_FRAME = '''
+import sys, time
+import pygame
+start = float(sys.argv[1])
+
+def firstFrame(*args):
+    print('firstFrame', time.time() - start)
+    raise SystemExit(0)
+
+pygame.display.update = firstFrame
+pygame.display.flip = firstFrame
+import blackjack
+blackjack.mainGame()
+'''
+
+def runPython(code, *args):
+    env = dict(os.environ, SDL_VIDEODRIVER='dummy', SDL_AUDIODRIVER='dummy', PYGAME_HIDE_SUPPORT_PROMPT='1')
+    output = subprocess.check_output([sys.executable, '-W', 'ignore', '-c', code] + list(args), env=env,
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+    return output.decode().split()
+
+def measureImport(module):
+    """ Returns (milliseconds, importedPygame, displayStarted, mixerStarted) of importing module. """
+
+    seconds, importedPygame, displayStarted, mixerStarted = runPython(MEASURE_IMPORT % module)
+    return float(seconds) * 1000, importedPygame == 'True', displayStarted == 'True', mixerStarted == 'True'
+
+def measureFirstFrame():
+    import time
+    # the training process started by the game prints too
+    output = runPython(MEASURE_FIRST_FRAME, repr(time.time()))
+    return float(output[output.index('firstFrame') + 1]) * 1000
+
+def test():
+    # warm the .pyc files first, the budgets are for a normal launch, not the first one after a change
+    for module in IMPORT_BUDGETS:
+        measureImport(module)
+
+    for module, budget in sorted(IMPORT_BUDGETS.items()):
+        milliseconds, importedPygame, displayStarted, mixerStarted = measureImport(module)
+        print('import %-10s %6.1f ms (budget %d ms)' % (module, milliseconds, budget))
+        assert milliseconds <= budget, (module, milliseconds, budget)
+        assert not displayStarted and not mixerStarted, (module, 'started pygame on import')
+    for module in NO_PYGAME:
+        assert not measureImport(module)[1], (module, 'imports pygame')
+    print('%s import without pygame' % ', '.join(NO_PYGAME))
+
+    milliseconds = measureFirstFrame()
+    print('first frame %9.1f ms (budget %d ms)' % (milliseconds, FIRST_FRAME_BUDGET))
+    assert milliseconds <= FIRST_FRAME_BUDGET, milliseconds
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,157 @@
+import atexit
+import multiprocessing
+import queue
+import time
+
+"""
+Trains the ai in a worker process, so the game does not wait for it.
+
+The game always plays hit and stand with getExactPolicySet, the exact policy
+of solver.py, which only takes a fraction of a second to compute. A sampled Q
+learning policy can only be equal to it or worse, so the worker does not learn
+one. It learns what the exact policy does not know, one phase after the other:
+
+    full    every action with fullq.py, sent as fullPolicySet, limited to the
+            actions the game has (stand, hit and double), for the doubles
+    count   the count aware policies of counting.py for the one deck shoe of
+            the game, sent as countPolicySet
+
+TrainingProcess starts the worker and the game calls poll() every frame. The
+worker sends the phase it is in and its progress every checkpoint, then the
+policySet of the phase. The training is finished once every phase sent its
+policySet. Both Q tables are cached on disk by policycache, so a phase that
+was learned before only loads them and sends no progress.
+
+The worker is forked where possible: with spawn it would import the game's
+main module again. The game starts it before it opens the window and the
+mixer, so the worker does not inherit any SDL state. It is not a daemon, so
+the training is free to start processes of its own, and it is terminated when
+the game exits.
+"""
+
+PHASES = ['full', 'count']
+PHASE_NAMES = {'full': 'to double', 'count': 'to count cards'}
+
+def getExactPolicySet():
+    from ai import policyHelper
+    from solver import solveQMap
+    return policyHelper(solveQMap())
+
+def trainWorker(messages, options):
+    """ Runs in the worker process, puts ('progress', phase, episodes, maxEpisodes) during every phase, then
+    ('full', fullPolicySet), ('count', countPolicySet) and ('done',), or ('error', description) on the messages
+    queue. """
+
+    from counting import getCountPolicySet
+    from fullq import getFullPolicySet, STAND, HIT, DOUBLE
+
+    def progress(phase):
+        def report(episodes, maxEpisodes):
+            messages.put(('progress', phase, episodes, maxEpisodes))
+        return report
+
+    try:
+        messages.put(('full', getFullPolicySet(allowed=(STAND, HIT, DOUBLE), progress=progress('full'), **options)))
+        messages.put(('count', getCountPolicySet(decks=1, progress=progress('count'), **options)))
+        messages.put(('done',))
+    except Exception as e:
+        messages.put(('error', repr(e)))
+
+class TrainingProcess():
+    """ State of the training as seen by the game. phase is the phase being learned, None before the first
+    checkpoint. fraction goes from 0 to 1 in every phase and eta is the seconds left in the phase (None until its
+    first checkpoint). fullPolicySet and countPolicySet are None until their phase is done, see
+    fullq.fullPolicyHelper and counting.countPolicyHelper for their formats. options are passed to
+    fullq.getFullPolicySet and counting.getCountPolicySet (n_iter_q, alpha, discount, epsilon, useCache). """
+
+    def __init__(self, **options):
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        self.messages = context.Queue()
+        self.process = context.Process(target=trainWorker, args=(self.messages, options))
+        self.phase = None
+        self.phaseStart = time.perf_counter()
+        self.episodes = 0
+        self.maxEpisodes = 0
+        self.eta = None
+        self.finished = False
+        self.fullPolicySet = None
+        self.countPolicySet = None
+        self.error = None
+        self.process.start()
+        # registered after start, so it runs before multiprocessing joins its children at exit
+        atexit.register(self.stop)
+
+    def stop(self):
+        """ Terminates the worker if it is still training, closing the game does not wait for it. """
+
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+
+    @property
+    def fraction(self):
+        if self.finished:
+            return 1.0
+        return self.episodes / self.maxEpisodes if self.maxEpisodes else 0.0
+
+    def poll(self):
+        """ Reads the messages of the worker without waiting. Returns True when something changed. """
+
+        changed = False
+        while True:
+            try:
+                message = self.messages.get_nowait()
+            except queue.Empty:
+                if not self.finished and not self.process.is_alive() and self.messages.empty():
+                    self.finished = True
+                    self.error = 'the training process exited with code %s' % self.process.exitcode
+                    changed = True
+                break
+            changed = True
+            if message[0] == 'progress':
+                # a phase starts when the last one sent its policySet
+                self.phase, self.episodes, self.maxEpisodes = message[1:]
+                elapsed = time.perf_counter() - self.phaseStart
+                self.eta = elapsed * (self.maxEpisodes - self.episodes) / self.episodes
+            elif message[0] == 'full':
+                self.fullPolicySet = message[1]
+                self.phaseStart = time.perf_counter()
+            elif message[0] == 'count':
+                self.countPolicySet = message[1]
+                self.phaseStart = time.perf_counter()
+            elif message[0] == 'done':
+                self.finished = True
+            else:
+                self.finished = True
+                self.error = message[1]
+        return changed
+
+    def describe(self):
+        """ One line about the training for the screen. """
+
+        if self.finished:
+            if self.error is not None:
+                return 'AI training failed, using the exact policy'
+            return 'AI trained, it doubles and counts cards'
+        if self.eta is None:
+            return 'Training the AI, the exact policy is used meanwhile'
+        return 'Training the AI %s (%d of %d): %d%% (%.1fM episodes, %ds left)' % (
+            PHASE_NAMES[self.phase], PHASES.index(self.phase) + 1, len(PHASES), 100 * self.fraction,
+            self.episodes / 1e6, self.eta + 0.5)
+
+def test():
+    """ Trains both phases without the cache, smaller than the game does, and prints the progress like the
+    loading bar of the game would. """
+
+    training = TrainingProcess(n_iter_q=500000, useCache=False)
+    while not training.finished:
+        if training.poll():
+            print(training.describe())
+        time.sleep(0.1)
+    assert training.error is None, training.error
+    assert training.fullPolicySet is not None and training.countPolicySet is not None
+    print(training.describe())
+
+if __name__ == '__main__':
+    test()
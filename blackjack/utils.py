@@ -1,50 +1,180 @@
 import random
 import sys
-from settings import *
-
-
-def createDeck():
-    """ Creates a default deck which contains all 52 cards and returns it. """
-
-    deck = ['sj', 'sq', 'sk', 'sa', 'hj', 'hq', 'hk', 'ha', 'cj', 'cq', 'ck', 'ca', 'dj', 'dq', 'dk', 'da']
-    values = range(2, 11)
-    for x in values:
-        spades = "s" + str(x)
-        hearts = "h" + str(x)
-        clubs = "c" + str(x)
-        diamonds = "d" + str(x)
-        deck.append(spades)
-        deck.append(hearts)
-        deck.append(clubs)
-        deck.append(diamonds)
-    return deck
 
-def shuffle(deck):
-    """ Shuffles the deck using an implementation of the Fisher-Yates shuffling algorithm. n is equal to the length of the
-    deck - 1 (because accessing lists starts at 0 instead of 1). While n is greater than 0, a random number k between 0
-    and n is generated, and the card in the deck that is represented by the offset n is swapped with the card in the deck
-    represented by the offset k. n is then decreased by 1, and the loop continues. """
-
-    # ??? do we have better shuffle alg
-    n = len(deck) - 1
-    while n > 0:
-        k = random.randint(0, n)
-        temp = deck[k]
-        deck[k] = deck[n]
-        deck[n] = temp
-        # deck[k], deck[n] = deck[n], deck[k]
-        n -= 1
+"""
+Cards are ints from 0 to 51, suit * 13 + rank, with ranks going ace, 2 to 10,
+jack, queen, king. cardName turns them into the names used by the images, like
+'sa', 'h10' or 'dk'.
+"""
+
+SUITS = 's', 'h', 'c', 'd'
+RANKS = 'a', '2', '3', '4', '5', '6', '7', '8', '9', '10', 'j', 'q', 'k'
+CARD_NAMES = [suit + rank for suit in SUITS for rank in RANKS]
+CARD_CODES = dict((name, card) for card, name in enumerate(CARD_NAMES))
+# value of each card in the game, aces count 11
+CARD_POINTS = [11, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10] * len(SUITS)
+# Hi-Lo count of each card, like shoe.HI_LO: +1 for 2 to 6, 0 for 7 to 9, -1 for aces and tens
+HI_LO_POINTS = [-1, 1, 1, 1, 1, 1, 0, 0, 0, -1, -1, -1, -1] * len(SUITS)
+
+def cardName(card):
+    return CARD_NAMES[card]
+
+def cardCode(name):
+    return CARD_CODES[name]
+
+def isAce(card):
+    return card % 13 == 0
+
+def createDeck(decks=1):
+    """ Creates a default deck which contains all 52 cards (of every deck) and returns it. """
+
+    return list(range(0, 52)) * decks
+
+def getRandom(seed=None):
+    """ Returns seed if it already is a random.Random, else a new random.Random seeded with it. """
+
+    if isinstance(seed, random.Random):
+        return seed
+    return random.Random(seed)
 
+def shuffle(deck, rng=random):
+    """ Shuffles the deck in place with the Fisher-Yates shuffling algorithm of rng.shuffle, and returns it. rng is
+    a random.Random (see getRandom), by default the global random module. Pass your own to get the same shuffles
+    again. """
+
+    rng.shuffle(deck)
     return deck
 
-def returnFromDead(deck, deadDeck):
-    """ Appends the cards from the deadDeck to the deck that is in play. This is called when the main deck
-    has been emptied. """
+def shuffleShoes(shoes, decks=1, seed=None):
+    """ Returns an array of shoes rows, every row being its own shuffled shoe of decks decks. seed can be anything
+    numpy.random.default_rng takes, including a Generator. It is many times faster per shoe than shuffle, for
+    simulations that need many shoes at once. """
+
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    cards = np.tile(np.arange(0, 52, dtype=np.int8), (shoes, decks))
+    return rng.permuted(cards, axis=1)
+
+class Deck():
+    """ The cards of the game. They are dealt through a cursor into the shuffled cards, so dealing a card costs
+    the same no matter how many are left, and the cards dealt since the last shuffle are cards[:position].
+
+    Played cards go to the dead deck with discard. The whole deck is only reshuffled at the start of a round,
+    once the cards dealt reach the penetration (the cut card). If the deck runs out in the middle of a round, the
+    dead deck is shuffled and dealt from, like returnFromDead used to. Every shuffle uses rng.
+
+    runningCount is the Hi-Lo count of the cards dealt since the last shuffle, kept up to date as they are dealt,
+    and shuffles the number of shuffles so far, to tell whether a card was dealt since the last one. """
+
+    def __init__(self, decks=1, penetration=0.75, rng=random):
+        self.size = 52 * decks
+        self.cutCard = int(self.size * penetration)
+        self.random = rng
+        self.cards = shuffle(createDeck(decks), rng)
+        self.position = 0
+        self.deadDeck = []
+        self.runningCount = 0
+        self.shuffles = 0
+
+    def __len__(self):
+        """ Number of cards left to deal. """
+
+        return len(self.cards) - self.position
+
+    def draw(self):
+        if self.position == len(self.cards):
+            self.returnFromDead()
+        card = self.cards[self.position]
+        self.position += 1
+        self.runningCount += HI_LO_POINTS[card]
+        return card
+
+    def discard(self, cards):
+        self.deadDeck.extend(cards)
+
+    def dealt(self):
+        """ The cards dealt since the last shuffle. """
+
+        return self.cards[0:self.position]
+
+    def returnFromDead(self):
+        """ Shuffles the dead deck and deals from it, called when the deck is empty. """
+
+        self.cards = shuffle(self.deadDeck, self.random)
+        self.position = 0
+        self.deadDeck = []
+        self.runningCount = 0
+        self.shuffles += 1
+
+    def shuffle(self):
+        """ Puts the cards left and the dead deck back together and shuffles them. Every card dealt must have been
+        discarded. """
+
+        self.cards = shuffle(self.cards[self.position:] + self.deadDeck, self.random)
+        self.position = 0
+        self.deadDeck = []
+        self.runningCount = 0
+        self.shuffles += 1
+
+    def needsShuffle(self):
+        return self.position >= self.cutCard
+
+    def startRound(self):
+        """ Called before every round, reshuffles once the cut card has been reached. """
+
+        if self.needsShuffle():
+            self.shuffle()
+
+def chiSquarePositions(shuffled, cards=52):
+    """ Chi-square statistic of how often every card ends up at every position of the shuffled decks (rows), and
+    its degrees of freedom. For uniform shuffles every card is equally likely at every position. """
+
+    import numpy as np
+    shuffled = np.asarray(shuffled, dtype=np.int64)
+    n, size = shuffled.shape
+    counts = np.zeros((cards, size))
+    np.add.at(counts, (shuffled, np.broadcast_to(np.arange(0, size), shuffled.shape)), 1)
+    expected = n / cards
+    return ((counts - expected) ** 2 / expected).sum(), (cards - 1) * (size - 1)
+
+def test():
+    """ Checks that shuffle and shuffleShoes are uniform, reproducible with a seed, and compares their speed with
+    the old randint loop. """
+
+    import time
+    n_times = 100000
+
+    def oldShuffle(deck):
+        n = len(deck) - 1
+        while n > 0:
+            k = random.randint(0, n)
+            deck[k], deck[n] = deck[n], deck[k]
+            n -= 1
+        return deck
+
+    rng = getRandom(1)
+    samples = {
+        'shuffle': [shuffle(createDeck(), rng) for n in range(0, n_times)],
+        'shuffleShoes': shuffleShoes(n_times, seed=1),
+    }
+    for name, shuffled in samples.items():
+        # the statistic has a mean of dof and a standard deviation of sqrt(2 dof)
+        chiSquare, dof = chiSquarePositions(shuffled)
+        sigmas = (chiSquare - dof) / (2 * dof) ** 0.5
+        assert abs(sigmas) < 5, (name, chiSquare, dof)
+        print('%-12s chi-square %.0f for %d degrees of freedom (%+.1f sigma)' % (name, chiSquare, dof, sigmas))
 
-    for card in deadDeck:
-        deck.append(card)
+    assert shuffle(createDeck(), getRandom(7)) == shuffle(createDeck(), getRandom(7))
+    assert (shuffleShoes(10, 6, seed=7) == shuffleShoes(10, 6, seed=7)).all()
 
-    del deadDeck[:]
-    deck = shuffle(deck)
+    timings = []
+    for name, function in [('randint loop', lambda: [oldShuffle(createDeck()) for n in range(0, n_times)]),
+                           ('shuffle', lambda: [shuffle(createDeck(), rng) for n in range(0, n_times)]),
+                           ('shuffleShoes', lambda: shuffleShoes(n_times))]:
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+        print('%-12s %10.0f decks/s (%.1fx)' % (name, n_times / timings[-1], timings[0] / timings[-1]))
 
-    return deck, deadDeck
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,325 @@
+import multiprocessing
+import numpy as np
+
+"""
+Batched Q learning engine.
+
+It learns exactly the same thing as ai.q_learning, but instead of playing one
+episode at a time it plays a whole batch of episodes together, step by step,
+with numpy arrays.
+
+Q and the visit counters are dense arrays indexed by
+[dealerCard - 1, playerTotal - 2, hasUseableAce, action]
+where action 1 is hit (True in the qMap) and action 0 is stand (False).
+
+All the episodes of a batch that are still running take one step together,
+every (state, action) pair touched in that step is updated once with the sum
+of its diffs divided by its new count. With alpha = 1 this is exactly the
+running average ai.q_learning computes, the only difference is that episodes
+in the same step see the Q values from before that step.
+"""
+
+DEALER_CARDS = 11
+PLAYER_TOTALS = 20
+STATE_SHAPE = (DEALER_CARDS, PLAYER_TOTALS, 2, 2)
+N_STATES = DEALER_CARDS * PLAYER_TOTALS * 2
+
+BATCH_SIZE = 16384
+
+def initializeQArray():
+    """ Same initial values as ai.initializeQMap. """
+
+    Q = np.zeros(STATE_SHAPE)
+    Q[:, :8, :, 1] = 0.1
+    Q[:, :8, :, 0] = -0.1
+    return Q
+
+def initializeCounterArray():
+    return np.zeros(STATE_SHAPE)
+
+def qMapToArray(qMap):
+    """ Converts a qMap keyed by ((dealerCard, playerTotal, hasUseableAce), action) into a Q array. """
+
+    Q = np.zeros(STATE_SHAPE)
+    for ((dealerCard, playerTotal, hasUseableAce), action), value in qMap.items():
+        Q[dealerCard - 1, playerTotal - 2, int(hasUseableAce), int(action)] = value
+    return Q
+
+def qArrayToMap(Q):
+    """ Converts a Q array back into the qMap format used by ai.py, so policyHelper and print_policy work on it. """
+
+    qMap = {}
+    for dealerCard in range(1, DEALER_CARDS + 1):
+        for playerTotal in range(2, PLAYER_TOTALS + 2):
+            for hasUseableAce in [True, False]:
+                state = (dealerCard, playerTotal, hasUseableAce)
+                for action in [True, False]:
+                    qMap[(state, action)] = float(Q[dealerCard - 1, playerTotal - 2, int(hasUseableAce), int(action)])
+    return qMap
+
+def drawCards(rng, n):
+    """ Vectorized ai.drawCard, n cards from an infinite deck. """
+
+    return np.minimum(rng.integers(1, 14, n), 10)
+
+def handTotals(total, hasAce):
+    """ Vectorized ai.getHandTotal. """
+
+    return total + 10 * (hasAce & (total + 10 <= 21))
+
+def dealerPlayBatch(total, hasAce, rng):
+    """ Vectorized ai.dealerPlay, every hand draws until it reaches 17. Returns the final totals. """
+
+    total = total.copy()
+    hasAce = hasAce.copy()
+    values = handTotals(total, hasAce)
+    drawing = np.flatnonzero(values < 17)
+    while drawing.size:
+        cards = drawCards(rng, drawing.size)
+        total[drawing] += cards
+        hasAce[drawing] |= (cards == 1)
+        values[drawing] = handTotals(total[drawing], hasAce[drawing])
+        drawing = drawing[values[drawing] < 17]
+    return values
+
+def getRewardsByTotals(dealerValues, playerValues):
+    """ Vectorized ai.getRewardByHands working on the hand totals. """
+
+    rewards = np.sign(playerValues - dealerValues).astype(float)
+    rewards[dealerValues > 21] = 1.0
+    rewards[playerValues > 21] = -1.0
+    return rewards
+
+def stateIndex(dealerCard, playerTotal, hasUseableAce):
+    """ Flat index of the states in Q.reshape(-1, 2). """
+
+    return ((dealerCard - 1) * PLAYER_TOTALS + (playerTotal - 2)) * 2 + hasUseableAce
+
+def runBatch(Q, counter, n, alpha, discount, epsilon, rng, instrumentation=None):
+    """ Plays n episodes of ai.q_learning together, updating Q and counter in place. With an instrumentation of
+    profiling.py, the time of the action selection, the hits, the dealer play and the update is recorded in it. """
+
+    timed = instrumentation is not None
+    if timed:
+        instrumentation.begin('runBatch')
+        clock = instrumentation.clock
+        selectKey, hitKey, standKey, updateKey = [instrumentation.key(name)
+                                                  for name in ['select', 'hit', 'dealerPlay', 'update']]
+
+    qFlat = Q.reshape(-1)
+    counterFlat = counter.reshape(-1)
+    size = qFlat.size
+
+    # select the start states randomly, the same way getRandomState does
+    dealerCard = rng.integers(1, DEALER_CARDS + 1, n)
+    playerValue = rng.integers(2, PLAYER_TOTALS + 2, n)
+    useable = rng.integers(0, 2, n).astype(bool)
+
+    # getHandsFromState
+    playerTotal = playerValue - 10 * useable
+    playerAce = useable
+    dealerTotal = dealerCard.copy()
+    dealerAce = dealerCard == 1
+
+    state = stateIndex(dealerCard, playerValue, useable)
+
+    while state.size:
+        m = state.size
+        if timed:
+            start = clock()
+
+        # epsilon greedy action, ties go to stand just like getBestActionByQ
+        greedy = qFlat[2 * state + 1] > qFlat[2 * state]
+        explore = rng.random(m) < epsilon
+        action = np.where(explore, rng.integers(0, 2, m).astype(bool), greedy)
+
+        stateAction = 2 * state + action
+        counterFlat += np.bincount(stateAction, minlength=size)
+
+        targets = np.empty(m)
+        continuing = np.zeros(m, dtype=bool)
+        if timed:
+            instrumentation.record(selectKey, clock() - start)
+            start = clock()
+
+        # Player hits
+        hits = np.flatnonzero(action)
+        if hits.size:
+            cards = drawCards(rng, hits.size)
+            playerTotal[hits] += cards
+            playerAce[hits] |= (cards == 1)
+            values = handTotals(playerTotal[hits], playerAce[hits])
+            alive = values <= 21
+            nextState = stateIndex(dealerCard[hits], np.minimum(values, 21),
+                                   playerAce[hits] & (playerTotal[hits] + 10 <= 21))
+            maxQ = np.maximum(qFlat[2 * nextState], qFlat[2 * nextState + 1])
+            targets[hits] = np.where(alive, discount * maxQ, -1.0)
+            continuing[hits] = alive
+            state[hits] = nextState
+        if timed:
+            instrumentation.record(hitKey, clock() - start)
+            start = clock()
+
+        # Player stands
+        stands = np.flatnonzero(~action)
+        if stands.size:
+            dealerValues = dealerPlayBatch(dealerTotal[stands], dealerAce[stands], rng)
+            playerValues = handTotals(playerTotal[stands], playerAce[stands])
+            targets[stands] = getRewardsByTotals(dealerValues, playerValues)
+        if timed:
+            instrumentation.record(standKey, clock() - start)
+            start = clock()
+
+        # Update Q, every pair touched in this step gets all of its diffs at once
+        diffs = np.bincount(stateAction, weights=targets - qFlat[stateAction], minlength=size)
+        touched = np.flatnonzero(diffs)
+        qFlat[touched] += alpha * diffs[touched] / counterFlat[touched]
+        if timed:
+            instrumentation.record(updateKey, clock() - start)
+
+        # keep the episodes that have not finished yet
+        state = state[continuing]
+        dealerCard = dealerCard[continuing]
+        dealerTotal = dealerTotal[continuing]
+        dealerAce = dealerAce[continuing]
+        playerTotal = playerTotal[continuing]
+        playerAce = playerAce[continuing]
+
+    if timed:
+        instrumentation.end()
+
+def runEpisodes(Q, counter, learningTimes, alpha, discount, epsilon, rng, batchSize=BATCH_SIZE,
+                instrumentation=None):
+    """ Plays learningTimes episodes in batches of batchSize, updating Q and counter in place. """
+
+    done = 0
+    while done < learningTimes:
+        n = min(batchSize, learningTimes - done)
+        runBatch(Q, counter, n, alpha, discount, epsilon, rng, instrumentation)
+        done += n
+    return Q, counter
+
+# Q learning.
+def q_learning_vectorized(learningTimes, alpha, discount, epsilon, seed=None, batchSize=BATCH_SIZE,
+                          instrumentation=None):
+    """ Batched version of ai.q_learning, returns the Q array. Use qArrayToMap to get a qMap. """
+
+    rng = np.random.default_rng(seed)
+    Q = initializeQArray()
+    counter = initializeCounterArray()
+    if instrumentation is not None:
+        instrumentation.begin('q_learning_vectorized')
+    runEpisodes(Q, counter, learningTimes, alpha, discount, epsilon, rng, batchSize, instrumentation)
+    if instrumentation is not None:
+        instrumentation.end()
+    return Q
+
+def trainShard(args):
+    """ Runs one worker's share of episodes on copies of Q and counter, used by q_learning_parallel. """
+
+    Q, counter, learningTimes, alpha, discount, epsilon, seed, batchSize = args
+    Q = Q.copy()
+    counter = counter.copy()
+    runEpisodes(Q, counter, learningTimes, alpha, discount, epsilon, np.random.default_rng(seed), batchSize)
+    return Q, counter
+
+def mergeQArrays(Q, counter, results):
+    """ Merges the (Q, counter) results of workers that all started from Q and counter.
+
+    Each worker's change to a Q value is weighted by the number of visits it made to that pair, so the
+    merged Q is the count-weighted average of the workers' Q values. """
+
+    visits = [workerCounter - counter for workerQ, workerCounter in results]
+    totalVisits = sum(visits)
+    weighted = sum(v * (workerQ - Q) for v, (workerQ, workerCounter) in zip(visits, results))
+    merged = Q + np.divide(weighted, totalVisits, out=np.zeros_like(Q), where=totalVisits > 0)
+    return merged, counter + totalVisits
+
+def splitEvenly(total, parts):
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+def q_learning_parallel(learningTimes, workers, alpha, discount, epsilon, seed=None, syncTimes=1,
+                        batchSize=BATCH_SIZE):
+    """ q_learning_vectorized with the episodes shared between workers processes.
+
+    The episodes are split into syncTimes rounds. In each round every worker starts from the merged Q and
+    counter of the previous round and plays its share with its own random stream, then the results are
+    merged with mergeQArrays. Every worker of every round gets a stream spawned from seed, so the result
+    only depends on seed, workers and syncTimes. """
+
+    Q = initializeQArray()
+    counter = initializeCounterArray()
+    seeds = np.random.SeedSequence(seed).spawn(workers * syncTimes)
+
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        for r, roundTimes in enumerate(splitEvenly(learningTimes, syncTimes)):
+            jobs = []
+            for w, shardTimes in enumerate(splitEvenly(roundTimes, workers)):
+                jobs.append((Q, counter, shardTimes, alpha, discount, epsilon, seeds[r * workers + w], batchSize))
+            if pool is None:
+                results = [trainShard(job) for job in jobs]
+            else:
+                results = pool.map(trainShard, jobs)
+            Q, counter = mergeQArrays(Q, counter, results)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return Q
+
+def getPolicyArray(Q):
+    """ Best action (True for hit) of every state policyHelper covers, dealer cards 1 to 10. """
+
+    policyQ = Q[:DEALER_CARDS - 1]
+    return policyQ[..., 1] > policyQ[..., 0]
+
+def q_learning_until_converged(maxLearningTimes, alpha, discount, epsilon, checkpointTimes=100000,
+                               churnThreshold=1, deltaThreshold=0.01, patience=3, seed=None, batchSize=BATCH_SIZE,
+                               progress=None, instrumentation=None):
+    """ q_learning_vectorized that stops once the policy stopped changing, with maxLearningTimes as a ceiling.
+
+    Every checkpointTimes episodes it counts the states of policyHelper whose best action flipped since the
+    last checkpoint (the churn) and the largest change of their best Q value. The Q value of the action that
+    is not taken keeps moving for a long time because it is only tried with epsilon, but it does not change
+    the policy. Training stops when both stay under churnThreshold and deltaThreshold for patience
+    checkpoints in a row. Returns (Q, learningTimes, reason) where reason is 'converged' or 'ceiling'.
+
+    If given, progress(learningTimes, maxLearningTimes, churn, maxDelta) is called at every checkpoint, and
+    the batches are timed in instrumentation, see profiling.py. """
+
+    rng = np.random.default_rng(seed)
+    Q = initializeQArray()
+    counter = initializeCounterArray()
+    policy = getPolicyArray(Q)
+    values = Q[:DEALER_CARDS - 1].max(axis=-1)
+    done = 0
+    calm = 0
+    # the whole run is one phase, the checkpoints included
+    if instrumentation is not None:
+        instrumentation.begin('q_learning_until_converged')
+    try:
+        while done < maxLearningTimes:
+            n = min(checkpointTimes, maxLearningTimes - done)
+            runEpisodes(Q, counter, n, alpha, discount, epsilon, rng, batchSize, instrumentation)
+            done += n
+
+            newPolicy = getPolicyArray(Q)
+            newValues = Q[:DEALER_CARDS - 1].max(axis=-1)
+            churn = int(np.count_nonzero(newPolicy != policy))
+            maxDelta = float(np.abs(newValues - values).max())
+            policy = newPolicy
+            values = newValues
+            if progress is not None:
+                progress(done, maxLearningTimes, churn, maxDelta)
+
+            if churn <= churnThreshold and maxDelta <= deltaThreshold:
+                calm += 1
+                if calm >= patience:
+                    return Q, done, 'converged'
+            else:
+                calm = 0
+        return Q, done, 'ceiling'
+    finally:
+        if instrumentation is not None:
+            instrumentation.end()